@@ -0,0 +1,245 @@
+import gdsfactory as gf
+import klayout.db as kdb
+
+import argparse
+import datetime
+import json
+import pathlib
+import shlex
+import subprocess
+import sys
+import time
+
+import params
+import profiler
+
+# Cell factories of device.py, each timed with an empty cell cache
+CELLS = [
+    "chip_border",
+    "center_carriage",
+    "r_flexure_full",
+    "r_drive_half",
+    "r_connectors_half",
+    "r_sensor_half",
+    "electrical_interconnect",
+    "z_cant",
+    "z_actuator",
+    "z_clamp",
+    "device",
+]
+
+# device.py constants overridden for each variant
+VARIANTS = {
+    "real": {},
+    # Twice as many rotary drive teeth
+    "rdrive_teeth_x2": {"RDRIVE_TEETH_PITCH": 1 / 3},
+    # Twice as many vertices on every arc
+    "angle_resolution_half": {"ANGLE_RESOLUTION": 0.25},
+}
+
+BASELINE = "bench_baseline.json"
+RESULTS = "./build/bench.json"
+
+# A regression is an increase of more than the threshold in any of these
+METRICS = ["wall", "cpu", "peak_rss", "polygons", "vertices"]
+REGRESSION_THRESHOLD = 0.1
+
+# Shorter times are mostly noise and not compared
+MIN_TIME = 0.1
+
+
+def bench_cells(values: dict, repeat: int) -> dict:
+    import device
+
+    out = {}
+    with params.override(device, values):
+        for name in CELLS:
+            wall = cpu = float("inf")
+            for _ in range(repeat):
+                gf.clear_cache()
+                start, start_cpu = time.perf_counter(), time.process_time()
+                c = getattr(device, name)()
+                wall = min(wall, time.perf_counter() - start)
+                cpu = min(cpu, time.process_time() - start_cpu)
+
+            layout = c.kdb_cell.layout()
+            polygons, vertices = profiler.counts(
+                kdb.Region(c.kdb_cell.begin_shapes_rec(layer))
+                for layer in layout.layer_indexes()
+            )
+            out[name] = {
+                "wall": wall,
+                "cpu": cpu,
+                "polygons": polygons,
+                "vertices": vertices,
+            }
+            print(f"{name:<28}{wall:>8.2f} s{polygons:>10} polygons", flush=True)
+    return out
+
+
+def bench_build(values: dict, repeat: int, build_args: list[str]) -> dict:
+    # build.py phases from its --profile trace
+    date_str = str(datetime.date.today())
+    trace = pathlib.Path(f"./build/mega_2d_bench__{date_str}_PROFILE.json")
+
+    out = {}
+    for _ in range(repeat):
+        subprocess.run(
+            [sys.executable, "build.py", "--version", "bench", "--profile"]
+            + [f"--set={name}={value!r}" for name, value in values.items()]
+            + build_args,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        events = json.loads(trace.read_text())["traceEvents"]
+        for name, total in profiler.totals(events).items():
+            total["polygons"] = total.pop("polygons_out")
+            total["vertices"] = total.pop("vertices_out")
+            best = out.setdefault(name, total)
+            for metric in ["wall", "cpu", "peak_rss"]:
+                best[metric] = min(best[metric], total[metric])
+
+    for name, total in out.items():
+        print(f"{name:<28}{total['wall']:>8.2f} s{total['polygons']:>10} polygons")
+    return out
+
+
+def run(args):
+    results = {"date": str(datetime.date.today()), "variants": {}}
+    for variant in args.variants:
+        print(f"# {variant}")
+        values = VARIANTS[variant]
+        results["variants"][variant] = {"cells": bench_cells(values, args.repeat)}
+        if not args.no_build:
+            results["variants"][variant]["build"] = bench_build(
+                values, args.repeat, shlex.split(args.build_args)
+            )
+
+    paths = [args.output] + ([args.baseline] if args.save_baseline else [])
+    for path in paths:
+        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        pathlib.Path(path).write_text(json.dumps(results, indent=2))
+
+
+def compare(args):
+    baseline = json.loads(pathlib.Path(args.baseline).read_text())["variants"]
+    results = json.loads(pathlib.Path(args.results).read_text())["variants"]
+
+    regressions = 0
+    print(
+        f"{'benchmark':<56}{'metric':>10}{'baseline':>14}{'current':>14}{'change':>9}"
+    )
+    for variant, sections in results.items():
+        for section, benchmarks in sections.items():
+            for name, current in benchmarks.items():
+                before = baseline.get(variant, {}).get(section, {}).get(name)
+                if before is None:
+                    continue
+                for metric in METRICS:
+                    if metric not in current or metric not in before:
+                        continue
+                    if (
+                        metric in ["wall", "cpu"]
+                        and max(before[metric], current[metric]) < MIN_TIME
+                    ):
+                        continue
+                    change = (
+                        current[metric] / before[metric] - 1 if before[metric] else 0
+                    )
+                    if abs(change) <= args.threshold:
+                        continue
+                    regressions += change > 0
+                    print(
+                        f"{f'{variant}/{section}/{name}':<56}{metric:>10}"
+                        f"{before[metric]:>14.6g}{current[metric]:>14.6g}{change:>+9.0%}"
+                        + ("  REGRESSION" if change > 0 else "")
+                    )
+
+    print(f"{regressions} regression(s) above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for MEGA-2D")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_run = subparsers.add_parser(
+        "run", help="Time the device cells and build.py phases"
+    )
+    parser_run.add_argument(
+        "--variants",
+        action="store",
+        nargs="+",
+        choices=list(VARIANTS),
+        help="Design variants to benchmark",
+        default=list(VARIANTS),
+    )
+    parser_run.add_argument(
+        "--repeat",
+        action="store",
+        type=int,
+        help="Runs per benchmark, the fastest one counts",
+        default=1,
+    )
+    parser_run.add_argument(
+        "--no-build",
+        action="store_true",
+        help="Only benchmark the device cells",
+    )
+    parser_run.add_argument(
+        "--build-args",
+        action="store",
+        type=str,
+        help='Extra build.py arguments, e.g. "--tile-size 1000 --jobs 8"',
+        default="",
+    )
+    parser_run.add_argument(
+        "--output",
+        action="store",
+        type=str,
+        help="Results file",
+        default=RESULTS,
+    )
+    parser_run.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store the results as the new baseline",
+    )
+    parser_run.add_argument(
+        "--baseline",
+        action="store",
+        type=str,
+        help="Baseline file",
+        default=BASELINE,
+    )
+
+    parser_compare = subparsers.add_parser(
+        "compare", help="Compare results against the baseline"
+    )
+    parser_compare.add_argument(
+        "results",
+        action="store",
+        nargs="?",
+        help="Results file",
+        default=RESULTS,
+    )
+    parser_compare.add_argument(
+        "--baseline",
+        action="store",
+        type=str,
+        help="Baseline file",
+        default=BASELINE,
+    )
+    parser_compare.add_argument(
+        "--threshold",
+        action="store",
+        type=float,
+        help="Relative increase that counts as a regression",
+        default=REGRESSION_THRESHOLD,
+    )
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
@@ -1,39 +1,39 @@
 import gdsfactory as gf
+import klayout.db as kdb
 
 gf.clear_cache()
 
 
 import gfelib as gl
 
+import os
 import sys
+import tempfile
 import datetime
 import argparse
-
+import functools
+import importlib
+
+import cellcache
+import drc
+import holes
+import incremental
+import merge
+import output
+import params
+import profiler
+import serialize
+import stream
+import symmetry
+import tiling
+import vertices
+import wafer
 from pdk import LAYERS, PDK
-from device import (
-    RFLEX_PROTECTION_ISOLATION,
-    device,
-    CHIP_SIZE,
-    CAVITY_WIDTH,
-    DEVICE_MIN_ISOLATION,
-)
 
 DEVICE_CD_COMPENSATION_DEFAULT = 0.3
 HANDLE_CD_COMPENSATION_DEFAULT = 0
-
-# Isolation distance for device layers
-DEVICE_MERGING_ISOLATION = [
-    DEVICE_MIN_ISOLATION,  # P0
-    DEVICE_MIN_ISOLATION,  # P1
-    RFLEX_PROTECTION_ISOLATION,  # P2
-    DEVICE_MIN_ISOLATION,  # P3
-    DEVICE_MIN_ISOLATION,  # P4
-    DEVICE_MIN_ISOLATION,  # P5
-    DEVICE_MIN_ISOLATION,  # P6
-    DEVICE_MIN_ISOLATION,  # P7
-]
-
-HANDLE_MERGING_ISOLATION = CAVITY_WIDTH
+MAX_MEMORY_TILE_SIZE_DEFAULT = 1000
+STREAM_TILE_SIZE_DEFAULT = 1000
 
 # Layers for generating reticle/masks
 reticle_layers = {
@@ -54,6 +54,11 @@ parser.add_argument(
     action="store_true",
     help="Don't merge the device patterns (e.g. release holes), because it can be very slow. For debug use only, ASML reticle files will not be generated",
 )
+parser.add_argument(
+    "--no-drc",
+    action="store_true",
+    help="Don't check the merged layers against the design rules of device.py",
+)
 # parser.add_argument(
 #     "--mirror",
 #     action="store_true",
@@ -92,22 +97,219 @@ parser.add_argument(
     help="Compensate device (+ is expand)",
     default=DEVICE_CD_COMPENSATION_DEFAULT,
 )
+parser.add_argument(
+    "--tile-size",
+    action="store",
+    type=float,
+    help="Merge in square tiles of this size (um), processed in parallel. 0 merges the whole chip at once. Where a slanted edge crosses a tile border, the cut snaps to the grid, so results can differ from an untiled merge by 1 dbu there",
+    default=0,
+)
+parser.add_argument(
+    "--jobs",
+    action="store",
+    type=int,
+    help="Number of worker processes (default: all cores), 1 runs everything in this process",
+    default=None,
+)
+parser.add_argument(
+    "--symmetry",
+    action="store",
+    choices=["auto"] + list(symmetry.GROUPS),
+    help="Merge one fundamental domain of the given symmetry group and replicate it, features breaking the symmetry are merged on the full die. The full die is merged instead when that is cheaper. auto picks the cheapest group per layer pipeline",
+    default=None,
+)
+parser.add_argument(
+    "--cache-dir",
+    action="store",
+    type=str,
+    help="Keep generated device cells in this directory and reuse them across builds while their code and constants are unchanged",
+    default=None,
+)
+parser.add_argument(
+    "--cache-size",
+    action="store",
+    type=float,
+    help="Size limit of the cell cache (MB), least recently used cells are evicted first",
+    default=2048,
+)
+
+parser.add_argument(
+    "--hole-arrays",
+    action="store_true",
+    help="Place release holes as arrays of a shared hole cell, instead of flat polygons",
+)
+parser.add_argument(
+    "--incremental",
+    action="store_true",
+    help="Only re-merge the areas around device sub-cells that changed since the last incremental build, and patch its merged layers",
+)
+
+parser.add_argument(
+    "--profile",
+    action="store_true",
+    help="Print the time, memory and polygon counts of every build phase, and write them as a Chrome trace next to the build",
+)
+
+parser.add_argument(
+    "--vertex-report",
+    action="store_true",
+    help="Print the polygon and vertex counts per layer of the build, and its polygons with the most vertices with the source cells they come from",
+)
+
+parser.add_argument(
+    "--max-vertices",
+    action="store",
+    type=int,
+    help="Break polygons of the build into parts with at most this many vertices before writing",
+    default=None,
+)
+
+parser.add_argument(
+    "--deep",
+    action="store_true",
+    help="Run the merge, release holes and CD compensation on hierarchical (deep) regions in one piece, so geometry of identical cells is processed once. Not tiled, --jobs sets the number of threads",
+)
+
+parser.add_argument(
+    "--hierarchical",
+    action="store_true",
+    help="Keep the cell hierarchy of the merged layers in the build and reticles instead of flattening them, implies --deep",
+)
+
+parser.add_argument(
+    "--stream",
+    action="store_true",
+    help=f"Merge, release and compensate tile by tile and write each tile to the build GDS as soon as it is done, so the merged layers are never held whole, only --tile-size ({STREAM_TILE_SIZE_DEFAULT} um unless given) at a time. The flat sources of the whole die are still read up front and held for the run, so peak memory still grows with the die size. Polygons are cut at tile borders, reticles are not generated",
+)
+
+parser.add_argument(
+    "--max-memory",
+    action="store",
+    type=float,
+    help=f"Target peak memory (MB): layer pipelines are merged one at a time (in {MAX_MEMORY_TILE_SIZE_DEFAULT} um tiles unless --tile-size is given) and kept in temporary files until written, the device cells are freed once merged, and the peak is reported against the target. Before each pipeline, the workers (up to --jobs) and the tile size are chosen from its source vertices to fit in what the target leaves",
+    default=None,
+)
+
+parser.add_argument(
+    "--oasis",
+    action="store",
+    nargs="*",
+    choices=output.ARTIFACTS,
+    help="Write these artifacts (all if none given) as compressed OASIS instead of GDS",
+    default=None,
+)
+
+parser.add_argument(
+    "--set",
+    action="append",
+    metavar="NAME=VALUE",
+    help="Override a device.py constant (Python literal), constants derived from it follow. Can be given multiple times",
+    default=[],
+)
+
+parser.add_argument(
+    "--serialize",
+    action="store_true",
+    help="Also write the chip on a wafer with a unique label per die (version, row, column and serial), only the label window is merged again for each die",
+)
+
+parser.add_argument(
+    "--max-sagitta",
+    action="store",
+    type=float,
+    help="Largest distance between an arc and its polygon in nm, sets the angle resolution of each arc from its radius instead of using ANGLE_RESOLUTION",
+    default=None,
+)
 
 args = parser.parse_args()
 
+# --oasis alone writes all artifacts as OASIS
+oasis = output.ARTIFACTS if args.oasis == [] else args.oasis or []
+formats = {
+    artifact: "oas" if artifact in oasis else "gds" for artifact in output.ARTIFACTS
+}
+
+deep = args.deep or args.hierarchical
+if deep and args.incremental:
+    parser.error("--deep and --hierarchical do not work with --incremental")
+if args.max_memory and (deep or args.stream or args.incremental):
+    parser.error(
+        "--max-memory does not work with --deep, --hierarchical, --stream or --incremental"
+    )
+if args.max_memory and not args.tile_size:
+    args.tile_size = MAX_MEMORY_TILE_SIZE_DEFAULT
+if args.stream and not args.tile_size:
+    args.tile_size = STREAM_TILE_SIZE_DEFAULT
+if args.stream and (
+    deep or args.incremental or args.hole_arrays or formats["build"] == "oas"
+):
+    parser.error(
+        "--stream writes a flat GDS build and does not work with --deep, --hierarchical, --incremental, --hole-arrays or an OASIS build"
+    )
+if args.serialize and (deep or args.stream or args.max_memory):
+    parser.error(
+        "--serialize merges labels into the device sources and does not work with --deep, --hierarchical, --stream or --max-memory"
+    )
+
+# Overrides go in before anything reads the device constants
+overrides = params.parse(args.set)
+if args.max_sagitta is not None:
+    overrides["MAX_SAGITTA"] = args.max_sagitta
+params.apply(importlib.import_module("device"), overrides)
+
+from device import (
+    RFLEX_PROTECTION_ISOLATION,
+    RELEASE_SPEC,
+    RELEASE_SPEC_CHIP_BORDER,
+    RFLEX_RELEASE_SPEC,
+    device,
+    version_label,
+    CHIP_SIZE,
+    CAVITY_WIDTH,
+    DEVICE_MIN_ISOLATION,
+)
+
+# Isolation distance for device layers
+DEVICE_MERGING_ISOLATION = [
+    DEVICE_MIN_ISOLATION,  # P0
+    DEVICE_MIN_ISOLATION,  # P1
+    RFLEX_PROTECTION_ISOLATION,  # P2
+    DEVICE_MIN_ISOLATION,  # P3
+    DEVICE_MIN_ISOLATION,  # P4
+    DEVICE_MIN_ISOLATION,  # P5
+    DEVICE_MIN_ISOLATION,  # P6
+    DEVICE_MIN_ISOLATION,  # P7
+]
+
+HANDLE_MERGING_ISOLATION = CAVITY_WIDTH
+
+# Context kept around each tile for tiled merging, sizing with the default corner
+# mode reaches up to sqrt(2) times the sizing distance
+MERGE_HALO = 2 * max(DEVICE_MERGING_ISOLATION + [HANDLE_MERGING_ISOLATION])
+
+# Largest release hole, smaller isolated DEVICE_RELEASE polygons are placed as
+# arrays of shared cells with --hole-arrays
+HOLE_MAX_SIZE = 2 * max(
+    spec.hole_radius
+    for spec in [RELEASE_SPEC, RELEASE_SPEC_CHIP_BORDER, RFLEX_RELEASE_SPEC]
+)
+
+cellcache.configure(args.cache_dir, max_size=int(args.cache_size * 1024**2))
+profiler.ENABLED = args.profile
+
 date_str = str(datetime.date.today())
 
 filename_prefix = f"mega_2d_{args.version}_{args.hash[:7]}_{date_str}"
 
 WAFER_DIAMETER = 150000
-# WAFER_ALIGNMENT_MARKS = [
-#     (-40000, 2000),
-#     (40000, 2000),
-#     (-40000, -2000),
-#     (40000, -2000),
-#     (-8000, 48000),
-#     (8000, 48000),
-# ]
+WAFER_ALIGNMENT_MARKS = [
+    (-40000, 2000),
+    (40000, 2000),
+    (-40000, -2000),
+    (40000, -2000),
+    (-8000, 48000),
+    (8000, 48000),
+]
 
 CHIP_RECT = gf.components.rectangle(
     size=(CHIP_SIZE, CHIP_SIZE),
@@ -115,196 +317,366 @@ CHIP_RECT = gf.components.rectangle(
     centered=True,
 )
 
-d = device(ver=f"Ver {args.version}\n{args.hash[:7]}\n{date_str}")
+with profiler.phase("device"):
+    d = device()
+    label = version_label(f"Ver {args.version}\n{args.hash[:7]}\n{date_str}")
+
+with profiler.phase("write source"):
+    source = gf.Component()
+    _ = source << d
+    _ = source << label
+    output.write(
+        source,
+        f"./build/{filename_prefix}_SOURCE",
+        formats["source"],
+        with_metadata=True,
+    )
 
-d.write_gds(f"./build/{filename_prefix}_SOURCE.gds")
+# Hierarchical regions are kept in a DeepShapeStore
+dss = None
+if deep:
+    dss = kdb.DeepShapeStore()
+    dss.threads = args.jobs or os.cpu_count()
 
-c = gf.Component(name="chip")
+# The version label is merged together with the device, unless it is merged on
+# top of the merged stages afterwards
+label_merged = deep or args.stream or bool(args.max_memory)
+top = source if label_merged else d
+
+chip = merge.layer_regions(CHIP_RECT, [LAYERS.DUMMY], dss)[LAYERS.DUMMY]
+
+# Layer pipelines only depend on the source device, they run side by side
+stages = {}
 
 # DEVICE_Px isolation
-dev = gf.Component()
-
-for i in range(7, -1, -1):
-    dev = gf.boolean(
-        A=dev,
-        B=d,
-        operation="|",
-        layer=LAYERS.DEVICE,
-        layer1=LAYERS.DEVICE,
-        layer2=(LAYERS.DEVICE_P0[0], i),
-    )
+device_src = merge.layer_regions(
+    top,
+    [LAYERS.DEVICE, LAYERS.DEVICE_REMOVE]
+    + [(LAYERS.DEVICE_P0[0], i) for i in range(8)]
+    + [(LAYERS.DEVICE_P0[0], i + 10) for i in range(8)],
+    dss,
+)
+device_src[LAYERS.DUMMY] = chip
 
-    exp = gf.boolean(
-        A=gf.Component(),
-        B=d,
-        operation="|",
-        layer=LAYERS.DUMMY,
-        layer1=LAYERS.DUMMY,
-        layer2=(LAYERS.DEVICE_P0[0], i),
-    )
-    exp.offset(layer=LAYERS.DUMMY, distance=DEVICE_MERGING_ISOLATION[i])
-
-    iso = gf.boolean(
-        A=exp,
-        B=d,
-        operation="-",
-        layer=LAYERS.DUMMY,
-        layer1=LAYERS.DUMMY,
-        layer2=(LAYERS.DEVICE_P0[0], i),
-    )
+# Release holes are kept out of the merge, see RELEASE HOLES below
+release = merge.layer_regions(top, [LAYERS.DEVICE_RELEASE], dss)[LAYERS.DEVICE_RELEASE]
 
-    dev = gf.boolean(
-        A=dev,
-        B=iso,
-        operation="-",
-        layer=LAYERS.DEVICE,
-        layer1=LAYERS.DEVICE,
-        layer2=LAYERS.DUMMY,
-    )
+release_holes = kdb.Region()
+if args.hole_arrays:
+    release_holes, release = holes.split(release, gf.kcl.to_dbu(HOLE_MAX_SIZE))
 
-    # Merge NoISO layer
-    dev = gf.boolean(
-        A=dev,
-        B=d,
-        operation="|",
-        layer=LAYERS.DEVICE,
-        layer1=LAYERS.DEVICE,
-        layer2=(LAYERS.DEVICE_P0[0], i + 10),
+device_levels = [
+    (
+        (LAYERS.DEVICE_P0[0], i),
+        (LAYERS.DEVICE_P0[0], i + 10),
+        gf.kcl.to_dbu(DEVICE_MERGING_ISOLATION[i]),
     )
-
-# Pattern in layer DEVICE is always present in final design
-dev = gf.boolean(
-    A=dev,
-    B=d,
-    operation="|",
-    layer=LAYERS.DEVICE,
-    layer1=LAYERS.DEVICE,
-    layer2=LAYERS.DEVICE,
-)
+    for i in range(7, -1, -1)
+]
 
 if not args.no_merge:
     # DEVICE merged
-    _ = c << gf.boolean(
-        A=gf.boolean(
-            A=CHIP_RECT,
-            B=dev,
-            operation="-",
-            layer=LAYERS.DUMMY,
-            layer1=LAYERS.DUMMY,
-            layer2=LAYERS.DEVICE,
+    stages["device"] = (
+        functools.partial(
+            merge.device_remove,
+            levels=device_levels,
+            # Pattern in layer DEVICE is always present in final design
+            base=LAYERS.DEVICE,
+            chip=LAYERS.DUMMY,
+            layer=LAYERS.DEVICE_REMOVE,
         ),
-        B=d,
-        operation="|",
-        layer=LAYERS.DEVICE_REMOVE,
-        layer1=LAYERS.DUMMY,
-        layer2=LAYERS.DEVICE_REMOVE,
+        device_src,
     )
 else:
     # DEVICE and DEVICE_REMOVE not merged
-    c << dev
-    c << d.extract(layers=[LAYERS.DEVICE_REMOVE])
-
-# HANDLE
-handle = gf.Component()
-
-for i in range(7, -1, -1):
-    handle = gf.boolean(
-        A=handle,
-        B=d,
-        operation="-",
-        layer=LAYERS.DUMMY,
-        layer1=LAYERS.DUMMY,
-        layer2=(LAYERS.HANDLE_P0[0], i),
-    )
-
-    exp = gf.boolean(
-        A=gf.Component(),
-        B=d,
-        operation="|",
-        layer=LAYERS.DUMMY,
-        layer1=LAYERS.DUMMY,
-        layer2=(LAYERS.HANDLE_P0[0], i),
-    )
-    exp.offset(layer=LAYERS.DUMMY, distance=HANDLE_MERGING_ISOLATION)
-
-    border = gf.boolean(
-        A=exp,
-        B=d,
-        operation="-",
-        layer=LAYERS.DUMMY,
-        layer1=LAYERS.DUMMY,
-        layer2=(LAYERS.HANDLE_P0[0], i),
-    )
-
-    handle = gf.boolean(
-        A=handle,
-        B=border,
-        operation="|",
-        layer=LAYERS.DUMMY,
-        layer1=LAYERS.DUMMY,
-        layer2=LAYERS.DUMMY,
+    stages["device"] = (
+        functools.partial(
+            merge.device_merge,
+            levels=device_levels,
+            base=LAYERS.DEVICE,
+            layer=LAYERS.DEVICE_REMOVE,
+        ),
+        device_src,
     )
 
-_ = c << gf.boolean(
-    A=handle,
-    B=d,
-    operation="|",
-    layer=LAYERS.HANDLE_REMOVE,
-    layer1=LAYERS.DUMMY,
-    layer2=LAYERS.HANDLE_REMOVE,
+# HANDLE and HANDLE_STEP_ETCH
+handle_src = merge.layer_regions(
+    top,
+    [LAYERS.HANDLE_REMOVE, LAYERS.HANDLE_STEP_ETCH]
+    + [(LAYERS.HANDLE_P0[0], i) for i in range(8)],
+    dss,
 )
 
-# HANDLE_STEP_ETCH (must expose all HANDLE_REMOVE feature as well)
-_ = c << gf.boolean(
-    A=c,
-    B=d,
-    operation="|",
-    layer=LAYERS.HANDLE_STEP_ETCH,
-    layer1=LAYERS.HANDLE_REMOVE,
-    layer2=LAYERS.HANDLE_STEP_ETCH,
+stages["handle"] = (
+    functools.partial(
+        merge.handle_remove,
+        levels=[(LAYERS.HANDLE_P0[0], i) for i in range(7, -1, -1)],
+        border=gf.kcl.to_dbu(HANDLE_MERGING_ISOLATION),
+        layer=LAYERS.HANDLE_REMOVE,
+        step=LAYERS.HANDLE_STEP_ETCH,
+    ),
+    handle_src,
 )
 
+# Removal as drawn and NOISO features, the DRC tells them apart from the isolation
+# made by the merge
+drc_drawn = {}
+if not args.no_merge and not args.no_drc:
+    # The version label is not in the sources when it is merged on top afterwards
+    label_drawn = merge.LayerRegions()
+    if not label_merged:
+        label_drawn = merge.layer_regions(
+            label, [LAYERS.DEVICE_REMOVE, LAYERS.HANDLE_REMOVE], dss
+        )
+    drc_drawn = {
+        "drawn_remove": device_src[LAYERS.DEVICE_REMOVE]
+        + label_drawn[LAYERS.DEVICE_REMOVE]
+        + release
+        + release_holes,
+        "drawn_handle_remove": handle_src[LAYERS.HANDLE_REMOVE]
+        + label_drawn[LAYERS.HANDLE_REMOVE],
+        "rflex": device_src[LAYERS.DEVICE_P2],
+        "noiso": sum(
+            (device_src[(LAYERS.DEVICE_P0[0], i + 10)] for i in range(8)),
+            kdb.Region(),
+        ),
+    }
 
-# POSITIVE LAYERS
-for layer in [
+# POSITIVE and NEGATIVE LAYERS
+positive_layers = [
     LAYERS.VIAS_ETCH,
     LAYERS.TIP0,
     LAYERS.TIP1,
     LAYERS.TIP2,
     LAYERS.TIP3,
-]:
-    _ = c << gf.boolean(
-        A=CHIP_RECT,
-        B=d,
-        operation="&",
-        layer=layer,
-        layer1=LAYERS.DUMMY,
-        layer2=layer,
-    )
+]
+negative_layers = []
+
+chip_src = merge.layer_regions(top, positive_layers + negative_layers, dss)
+chip_src[LAYERS.DUMMY] = chip
+
+stages["chip"] = (
+    functools.partial(
+        merge.chip_layers,
+        chip=LAYERS.DUMMY,
+        positive=positive_layers,
+        negative=negative_layers,
+    ),
+    chip_src,
+)
 
-# NEGATIVE LAYERS
-for layer in []:
-    _ = c << gf.boolean(
-        A=CHIP_RECT,
-        B=d,
-        operation="-",
-        layer=layer,
-        layer1=LAYERS.DUMMY,
-        layer2=layer,
+run = functools.partial(
+    tiling.run,
+    tile_size=gf.kcl.to_dbu(args.tile_size),
+    halo=gf.kcl.to_dbu(MERGE_HALO),
+    jobs=args.jobs,
+    symmetry=args.symmetry,
+)
+
+# CD compensation (um)
+compensation = [
+    (LAYERS.DEVICE, args.comp_device),
+    (LAYERS.DEVICE_REMOVE, -args.comp_device),
+    (LAYERS.HANDLE_REMOVE, -args.comp_handle),
+]
+
+# Stages merged, released and compensated in one pass, for parts of the chip that
+# are finished on their own (--stream, --serialize). The device source needs the
+# DEVICE_RELEASE layer for this
+sizes = {layer: gf.kcl.to_dbu(distance) for layer, distance in compensation}
+finished = {}
+for name, (fn, src) in stages.items():
+    if name == "device":
+        fn = functools.partial(
+            merge.released,
+            fn=fn,
+            layer=LAYERS.DEVICE_REMOVE,
+            holes=LAYERS.DEVICE_RELEASE,
+        )
+    finished[name] = (functools.partial(merge.compensated, fn=fn, sizes=sizes), src)
+FINISHED_HALO = gf.kcl.to_dbu(
+    MERGE_HALO + 2 * max(abs(distance) for _, distance in compensation)
+)
+
+if args.stream:
+    # Every tile is merged, released and compensated on its own and written right
+    # away, the merged chip is never held in memory. The flat sources are, for
+    # the whole die
+    device_src[LAYERS.DEVICE_RELEASE] = release
+
+    with profiler.phase("merge"), stream.GdsWriter(
+        f"./build/{filename_prefix}_BUILD.gds"
+    ) as writer:
+
+        def write_tile(name, regions):
+            for layer, region in regions.items():
+                writer.region(layer, region)
+
+        writer.begin_cell("chip")
+        run(
+            finished,
+            halo=FINISHED_HALO,
+            symmetry=None,
+            sink=write_tile,
+        )
+        writer.end_cell()
+
+    profiler.report(f"./build/{filename_prefix}_PROFILE.json")
+    sys.exit()
+
+with profiler.phase("merge"):
+    if deep:
+        merged = {name: fn(src) for name, (fn, src) in stages.items()}
+    elif args.max_memory:
+        # One stage at a time, the others wait in temporary files. The device
+        # comes last, the release holes need it
+        spill = tempfile.TemporaryDirectory(dir="./build")
+        merged = {}
+        for name in sorted(stages, key=lambda name: name == "device"):
+            # Workers hold the tiles they merge on top of this process, as many
+            # as fit in what the target leaves, in smaller tiles if needed
+            tile_size, jobs = tiling.fit(
+                stages[name][1],
+                gf.kcl.to_dbu(args.tile_size),
+                gf.kcl.to_dbu(MERGE_HALO),
+                args.jobs or os.cpu_count(),
+                round(args.max_memory * 1024**2) - profiler.rss(),
+            )
+            result = run({name: stages[name]}, tile_size=tile_size, jobs=jobs)
+            merged[name] = result[name]
+            if name != "device":
+                merged[name] = merge.Spilled(merged[name], spill.name)
+    elif args.incremental:
+        merged = incremental.run(
+            stages,
+            [d, CHIP_RECT],
+            "./build/.incremental",
+            halo=gf.kcl.to_dbu(MERGE_HALO),
+            runner=run,
+        )
+    else:
+        merged = run(stages)
+
+# The version label is merged on top, only around the label
+if not label_merged:
+    with profiler.phase("label"):
+        merged = incremental.overlay(
+            merged, stages, label, halo=gf.kcl.to_dbu(MERGE_HALO), runner=run
+        )
+
+# RELEASE HOLES
+
+# Holes touching other removed areas merge with them and stay flat
+if not release_holes.is_empty():
+    flat_holes = release_holes.interacting(
+        merged["device"][LAYERS.DEVICE_REMOVE] + release
     )
+    release_holes -= flat_holes
+    release += flat_holes
+
+# Removed in one tiled pass after the merge, which only sees solid outlines
+release_src = merge.LayerRegions(
+    {
+        LAYERS.DEVICE_REMOVE: merged["device"][LAYERS.DEVICE_REMOVE],
+        LAYERS.DEVICE_RELEASE: release,
+    }
+)
+release_remove = functools.partial(
+    merge.release, layer=LAYERS.DEVICE_REMOVE, holes=LAYERS.DEVICE_RELEASE
+)
+with profiler.phase("release"):
+    if deep:
+        released = release_remove(release_src)
+    else:
+        released = run(
+            {"release": (release_remove, release_src)}, halo=0, symmetry=None
+        )["release"]
+    merged["device"][LAYERS.DEVICE_REMOVE] = released[LAYERS.DEVICE_REMOVE]
+
+# Nothing reads the device cells or the layer sources after the merge
+if args.max_memory and not args.vertex_report:
+    del d, label, source, top, stages, chip, device_src, handle_src, chip_src
+    del release, release_src, released
+    gf.clear_cache()
 
 # PROCESS COMPENSATION
 
-# Add CD compensation
-c.offset(layer=LAYERS.DEVICE, distance=args.comp_device)
-c.offset(layer=LAYERS.DEVICE_REMOVE, distance=-args.comp_device)
-c.offset(layer=LAYERS.HANDLE_REMOVE, distance=-args.comp_handle)
+# The only conversion to a component, stage by stage, each stage is freed once
+# inserted
+c = gf.Component(name="chip")
+for name in list(merged):
+    regions = merged.pop(name)
+    if isinstance(regions, merge.Spilled):
+        regions = regions.load()
+
+    # Add CD compensation
+    for layer, distance in compensation:
+        if layer in regions:
+            with profiler.phase(
+                f"offset {LAYERS(layer)}", inputs=[regions[layer]]
+            ) as p:
+                regions[layer] = regions[layer].sized(gf.kcl.to_dbu(distance))
+                p["outputs"] = [regions[layer]]
+
+    merge.insert(c, regions)
+
+# Deep regions are inserted as a cell hierarchy
+if deep and not args.hierarchical:
+    with profiler.phase("flatten"):
+        c.flatten()
+
+if not release_holes.is_empty():
+    with profiler.phase("hole arrays", inputs=[release_holes]):
+        _ = c << holes.hole_arrays(
+            release_holes,
+            LAYERS.DEVICE_REMOVE,
+            size=gf.kcl.to_dbu(-args.comp_device),
+        )
 
-c.flatten()
-c.write_gds(
-    f"./build/{filename_prefix}_BUILD.gds",
-    with_metadata=False,
-)
+if args.max_vertices:
+    # Flattening the layers for the counts costs as much as the split
+    counted = profiler.ENABLED
+    with profiler.phase(
+        "split",
+        inputs=merge.layer_regions(c, list(LAYERS)).values() if counted else None,
+    ) as p:
+        vertices.split(c, args.max_vertices)
+        if counted:
+            p["outputs"] = merge.layer_regions(c, list(LAYERS)).values()
+
+if args.vertex_report:
+    vertices.report(c, source, list(LAYERS))
+
+with profiler.phase("write build"):
+    output.write(c, f"./build/{filename_prefix}_BUILD", formats["build"])
+
+if not args.no_merge and not args.no_drc:
+    # Design rules of device.py on the final layers, tiled. Violations go to a
+    # marker database for the KLayout marker browser
+    final = merge.layer_regions(
+        c, [LAYERS.DEVICE_REMOVE, LAYERS.HANDLE_REMOVE, LAYERS.VIAS_ETCH]
+    )
+    drc_rules = drc.rules(
+        importlib.import_module("device"),
+        args.comp_device,
+        args.comp_handle,
+        dbu=gf.kcl.dbu,
+    )
+    with profiler.phase("drc", inputs=final.values()):
+        violations = drc.run(
+            {
+                "chip": kdb.Region(kdb.DBox(CHIP_SIZE, CHIP_SIZE).to_itype(gf.kcl.dbu)),
+                "device_remove": final[LAYERS.DEVICE_REMOVE],
+                "handle_remove": final[LAYERS.HANDLE_REMOVE],
+                "vias": final[LAYERS.VIAS_ETCH],
+                **drc_drawn,
+            },
+            drc_rules,
+            threads=args.jobs,
+            dbu=gf.kcl.dbu,
+        )
+    drc.save(violations, drc_rules, f"./build/{filename_prefix}_DRC.lyrdb", c.name)
+    drc.report(violations, drc_rules)
 
 if not args.no_merge:
 
@@ -315,22 +687,24 @@ if not args.no_merge:
         layer for layer, spec in reticle_layers.items() if spec["type"] == "wafer"
     ]
 
-    # generate stepper reticles
-    r = c.copy()
+    # generate stepper reticles, the image only holds the stepper layers of the
+    # chip (deep with --hierarchical to keep its cells)
+    image = merge.layer_regions(c, stepper_layers, dss if args.hierarchical else None)
 
     # Mirror the specified layers
     for layer in stepper_layers:
         if reticle_layers[layer]["mirror"]:
-            r.remove_layers([layer])
-            r << (c.extract([layer]).mirror_x())
-
-    reticles, placements = gb.asml300.reticle(
-        component=r,
-        image_size=(CHIP_SIZE, CHIP_SIZE),
-        image_layers=stepper_layers,
-        id=f"M2D-{args.version}",
-        text=date_str,
-    )
+            image[layer] = image[layer].transformed(kdb.Trans.M90)
+    r = merge.to_component(image)
+
+    with profiler.phase("reticle"):
+        reticles, placements = gb.asml300.reticle(
+            component=r,
+            image_size=(CHIP_SIZE, CHIP_SIZE),
+            image_layers=stepper_layers,
+            id=f"M2D-{args.version}",
+            text=date_str,
+        )
 
     for i, reticle in enumerate(reticles):
         for layer, pos in placements.items():
@@ -343,55 +717,127 @@ if not args.no_merge:
                     justify="center",
                     layer=LAYERS.DUMMY,
                 )
-        reticle.flatten()
-        reticle.write_gds(
-            f"./build/{filename_prefix}_RETICLE_ASML_{i}.gds", with_metadata=False
-        )
+
+    # Flattened and written side by side
+    output.write_all(
+        [
+            (reticle, f"./build/{filename_prefix}_RETICLE_ASML_{i}", formats["reticle"])
+            for i, reticle in enumerate(reticles)
+        ],
+        flatten=not args.hierarchical,
+        jobs=args.jobs,
+        name="write reticle",
+    )
 
     with open(f"./build/{filename_prefix}_RETICLE_ASML_PLACEMENTS.txt", "w") as f:
         for layer, pos in placements.items():
             f.write(f"{LAYERS(layer)}: {pos[0]}, {pos[1]:.2f}, {pos[2]:.2f}\n")
 
-# generate wafer masks for backside
-# for layer in [LAYERS.HANDLE_REMOVE, LAYERS.CAP_BACKSIDE]:
-#     wafer, placements = gb.asml300.wafer(
-#         radius=0.5 * WAFER_DIAMETER,
-#         chip_center=True,
-#         place_partial=False,
-#         marks=WAFER_ALIGNMENT_MARKS,
-#         component=c,
-#         image_size=(CHIP_SIZE, CHIP_SIZE),
-#         image_layer=layer,
-#         id=f"MPC-{args.version}-{LAYERS(layer)}",
-#         text=date_str,
-#     )
-#     wafer.write_gds(
-#         f"./build/mega_pc_{args.version}_BUILD_WAFER_{LAYERS(layer)}.gds",
-#         with_metadata=False,
-#     )
-
-#     if args.mirror:
-#         wafer.mirror_x(0)
-#         wafer.write_gds(
-#             f"./build/mega_pc_{args.version}_BUILD_WAFER_{LAYERS(layer)}_MIRROR.gds",
-#             with_metadata=False,
-#         )
-
-#     with open(
-#         f"./build/mega_pc_{args.version}_BUILD_WAFER_{LAYERS(layer)}_PLACEMENTS.txt",
-#         "w",
-#     ) as f:
-#         f.write(f"WAFER_DIAMETER: {WAFER_DIAMETER:.2f}\n")
-#         f.write(f"X_STEP_SIZE: {CHIP_SIZE:.2f}\n")
-#         f.write(f"Y_STEP_SIZE: {CHIP_SIZE:.2f}\n")
-#         f.write(f"CHIP_COUNT: {len(placements)}\n")
-#         f.write(f"\n")
-#         for mark in WAFER_ALIGNMENT_MARKS:
-#             f.write(f"MARK: {mark[0]:.2f}, {mark[1]:.2f}\n")
-#         f.write(f"\n")
-#         for placement in placements:
-#             f.write(f"CHIP: {placement[0]:.2f}, {placement[1]:.2f}\n")
+    # generate wafer masks for the backside layers, the merged chip is placed as
+    # arrays clipped to the wafer
+    for layer in wafer_layers:
+        chip = merge.layer_regions(c, [layer])[layer]
+        with profiler.phase("wafer", inputs=[chip]):
+            mask, placements = wafer.mask(
+                chip,
+                layer,
+                diameter=WAFER_DIAMETER,
+                pitch=CHIP_SIZE,
+                marks=WAFER_ALIGNMENT_MARKS,
+                outline_layer=LAYERS.DUMMY,
+                name=f"M2D-{args.version}-{LAYERS(layer)}",
+                mirror=reticle_layers[layer]["mirror"],
+                dbu=gf.kcl.dbu,
+            )
+            output.write_layout(
+                mask,
+                f"./build/{filename_prefix}_WAFER_{LAYERS(layer)}",
+                formats["reticle"],
+            )
+
+        with open(
+            f"./build/{filename_prefix}_WAFER_{LAYERS(layer)}_PLACEMENTS.txt", "w"
+        ) as f:
+            f.write(f"WAFER_DIAMETER: {WAFER_DIAMETER:.2f}\n")
+            f.write(f"X_STEP_SIZE: {CHIP_SIZE:.2f}\n")
+            f.write(f"Y_STEP_SIZE: {CHIP_SIZE:.2f}\n")
+            f.write(f"CHIP_COUNT: {len(placements)}\n")
+            f.write("\n")
+            for mark in WAFER_ALIGNMENT_MARKS:
+                f.write(f"MARK: {mark[0]:.2f}, {mark[1]:.2f}\n")
+            f.write("\n")
+            for placement in placements:
+                f.write(f"CHIP: {placement[0]:.2f}, {placement[1]:.2f}\n")
+
+if args.serialize:
+    # Dies on the same grid as the wafer masks, each with its own label. The chip
+    # outside the label window is shared, the windows of all dies are merged again
+    # with their labels in one run
+    placements = wafer.positions(WAFER_DIAMETER, CHIP_SIZE, WAFER_ALIGNMENT_MARKS)
+    ids = serialize.die_ids(placements, CHIP_SIZE)
+    offsets = [kdb.Vector(gf.kcl.to_dbu(x), gf.kcl.to_dbu(y)) for x, y in placements]
+    with profiler.phase("serial labels"):
+        labels = [
+            version_label(
+                f"Ver {args.version}\nR{row:02d} C{column:02d}\n#{serial:03d}"
+            )
+            for row, column, serial in ids
+        ]
+
+    # Also covers the version label of the chip, which the die labels replace
+    window = label.kdb_cell.bbox()
+    for serial_label in labels:
+        window += serial_label.kdb_cell.bbox()
+    window = window.enlarged(FINISHED_HALO, FINISHED_HALO)
+
+    serial_stages = dict(finished)
+    fn, src = finished["device"]
+    serial_stages["device"] = (
+        fn,
+        merge.LayerRegions({**src, LAYERS.DEVICE_RELEASE: release + release_holes}),
+    )
+    with profiler.phase("serialize"):
+        windows = serialize.patches(
+            serial_stages,
+            labels,
+            offsets,
+            window,
+            pitch=gf.kcl.to_dbu(CHIP_SIZE),
+            halo=FINISHED_HALO,
+            runner=run,
+        )
+        serialized = serialize.wafer(
+            c,
+            window,
+            windows,
+            offsets,
+            [f"DIE_R{row:02d}C{column:02d}" for row, column, _ in ids],
+            name=f"M2D-{args.version}-SERIALIZED",
+        )
+        output.write_layout(
+            serialized, f"./build/{filename_prefix}_WAFER_SERIALIZED", formats["build"]
+        )
 
+    with open(f"./build/{filename_prefix}_WAFER_SERIALIZED_PLACEMENTS.txt", "w") as f:
+        f.write(f"WAFER_DIAMETER: {WAFER_DIAMETER:.2f}\n")
+        f.write(f"X_STEP_SIZE: {CHIP_SIZE:.2f}\n")
+        f.write(f"Y_STEP_SIZE: {CHIP_SIZE:.2f}\n")
+        f.write(f"CHIP_COUNT: {len(placements)}\n")
+        f.write("\n")
+        for (x, y), (row, column, serial) in zip(placements, ids):
+            f.write(
+                f"CHIP: {x:.2f}, {y:.2f}, R{row:02d}, C{column:02d}, #{serial:03d}\n"
+            )
+
+
+profiler.report(f"./build/{filename_prefix}_PROFILE.json")
+
+if args.max_memory:
+    peak = profiler.peak_rss() / 1024**2
+    print(
+        f"Peak memory {peak:.0f} MB, target {args.max_memory:.0f} MB"
+        + (" (exceeded)" if peak > args.max_memory else "")
+    )
 
 if args.show:
     c.show()
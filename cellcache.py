@@ -0,0 +1,253 @@
+import gdsfactory as gf
+import klayout.db as kdb
+
+import functools
+import hashlib
+import inspect
+import os
+import pathlib
+import sys
+
+# Bump to invalidate every cached cell
+CACHE_FORMAT = 1
+
+# Disabled unless configured, see configure()
+CACHE_DIR: pathlib.Path | None = None
+CACHE_MAX_SIZE = 2 * 1024**3
+
+_loaded: dict[str, gf.Component] = {}
+
+# Cells in the layout by geometry digest, cached cells reference these instead of
+# copying them again. Dropped with the cells by gf.clear_cache()
+_cells: dict[str, kdb.Cell] = {}
+
+
+def configure(directory, max_size: int = CACHE_MAX_SIZE):
+    global CACHE_DIR, CACHE_MAX_SIZE
+    CACHE_DIR = pathlib.Path(directory) if directory else None
+    CACHE_MAX_SIZE = max_size
+    if CACHE_DIR:
+        (CACHE_DIR / "tmp").mkdir(parents=True, exist_ok=True)
+
+
+@functools.cache
+def _package_fingerprint(name: str) -> str:
+    package = sys.modules.get(name.split(".")[0])
+    if package is None:
+        return name
+    version = getattr(package, "__version__", "")
+    path = getattr(package, "__file__", None)
+    if path is None or "site-packages" in path:
+        return f"{name}=={version}"
+
+    # Local checkouts (e.g. the lib/ submodules) change without a version bump,
+    # modules of this repo only depend on their own file
+    files = [pathlib.Path(path)]
+    if files[0].name == "__init__.py":
+        files = sorted(files[0].parent.rglob("*.py"))
+    h = hashlib.sha256(version.encode())
+    for file in files:
+        h.update(file.read_bytes())
+    return f"{name}=={h.hexdigest()}"
+
+
+def _names(code) -> set[str]:
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _names(const)
+    return names
+
+
+def _fingerprint(obj, seen: set) -> str:
+    obj = inspect.unwrap(obj) if callable(obj) else obj
+
+    if inspect.ismodule(obj):
+        return _package_fingerprint(obj.__name__)
+
+    if isinstance(obj, functools.partial):
+        return (
+            _fingerprint(obj.func, seen)
+            + repr([_fingerprint(arg, seen) for arg in obj.args])
+            + repr({k: _fingerprint(v, seen) for k, v in obj.keywords.items()})
+        )
+
+    if inspect.isfunction(obj):
+        module = sys.modules.get(obj.__module__)
+        if module is None or "site-packages" in (getattr(module, "__file__", "")):
+            return f"{_package_fingerprint(obj.__module__)}:{obj.__qualname__}"
+        if obj in seen:
+            return obj.__qualname__
+        seen.add(obj)
+
+        # Source plus everything the function reads from its module globals,
+        # including the cells and helpers it calls
+        parts = [inspect.getsource(obj)]
+        for name in sorted(_names(obj.__code__)):
+            if name in obj.__globals__:
+                parts.append(f"{name}={_fingerprint(obj.__globals__[name], seen)}")
+        return "\n".join(parts)
+
+    if inspect.isclass(obj):
+        try:
+            return inspect.getsource(obj)
+        except (OSError, TypeError):
+            return f"{_package_fingerprint(obj.__module__)}:{obj.__qualname__}"
+
+    text = repr(obj)
+    # Default reprs carry the object address, which changes every run
+    return type(obj).__qualname__ if " at 0x" in text else text
+
+
+def key(func, args, kwargs) -> str:
+    h = hashlib.sha256()
+    h.update(str(CACHE_FORMAT).encode())
+    h.update(_fingerprint(func, set()).encode())
+    h.update(repr(args).encode())
+    h.update(repr(sorted(kwargs.items())).encode())
+    return h.hexdigest()
+
+
+def cell_digest(layout: kdb.Layout, index: int, memo: dict) -> str:
+    # Merkle digest, a cell changes if its shapes or any cell below it change
+    if index in memo:
+        return memo[index]
+
+    cell = layout.cell(index)
+    h = hashlib.sha256()
+    for layer in layout.layer_indexes():
+        shapes = cell.shapes(layer)
+        if shapes.is_empty():
+            continue
+        info = layout.get_info(layer)
+        h.update(f"L{info.layer}/{info.datatype}".encode())
+        for shape in shapes.each():
+            h.update(str(shape).encode())
+    for inst in cell.each_inst():
+        h.update(cell_digest(layout, inst.cell_index, memo).encode())
+        h.update(placement(inst).encode())
+
+    memo[index] = h.hexdigest()
+    return memo[index]
+
+
+def placement(inst: kdb.Instance) -> str:
+    return f"{inst.cplx_trans} {inst.a} {inst.b} {inst.na} {inst.nb}"
+
+
+def copy_cell(layout: kdb.Layout, index: int, target: kdb.Layout, cells: dict) -> int:
+    # Copies a cell and the cells below it into target. Cells with the same
+    # geometry as one in cells (digest -> target cell index) are referenced
+    # instead of copied again, the copies are added to cells
+    memo = {}
+
+    def copy(index: int) -> int:
+        digest = cell_digest(layout, index, memo)
+        if digest in cells:
+            return cells[digest]
+
+        cell = layout.cell(index)
+        name = cell.name
+        if target.has_cell(name):
+            name = f"{name}_{digest[:8]}"
+        new = target.cell(target.add_cell(name))
+        for layer in layout.layer_indexes():
+            if not cell.shapes(layer).is_empty():
+                new.shapes(target.layer(layout.get_info(layer))).insert(
+                    cell.shapes(layer)
+                )
+        for inst in cell.each_inst():
+            array = inst.cell_inst.dup()
+            array.cell_index = copy(inst.cell_index)
+            new.insert(array)
+
+        cells[digest] = new.cell_index()
+        return cells[digest]
+
+    return copy(index)
+
+
+def _share(cell: kdb.Cell):
+    memo = {}
+    layout = cell.layout()
+    for index in [cell.cell_index(), *cell.called_cells()]:
+        _cells.setdefault(cell_digest(layout, index, memo), layout.cell(index))
+
+
+def _load(path: pathlib.Path) -> gf.Component | None:
+    # Copies a cached cell into the layout, only its geometry, device cells have
+    # no ports. Cells below it that are in the layout already, loaded or built
+    # before, are referenced instead, so cells shared by cached cells stay
+    # shared. None if the file is gone, evicted by a parallel build since
+    # Read through a link of its own, which a parallel build cannot evict
+    tmp = CACHE_DIR / "tmp" / f"{os.getpid()}-{path.name}"
+    tmp.unlink(missing_ok=True)
+    try:
+        os.utime(path)  # Least recently used goes first
+        os.link(path, tmp)
+    except FileNotFoundError:
+        return None
+    source = kdb.Layout()
+    try:
+        source.read(str(tmp))
+    finally:
+        tmp.unlink()
+
+    layout = gf.kcl.layout
+    cells = {
+        digest: cell.cell_index()
+        for digest, cell in _cells.items()
+        if not cell._destroyed()
+    }
+    index = copy_cell(source, source.top_cell().cell_index(), layout, cells)
+    _cells.clear()
+    _cells.update({digest: layout.cell(i) for digest, i in cells.items()})
+
+    return gf.Component(base=gf.kcl[index].base)
+
+
+def _evict():
+    # Files evicted by a parallel build meanwhile are skipped
+    files = []
+    for file in CACHE_DIR.glob("*.oas"):
+        try:
+            files.append((file.stat(), file))
+        except FileNotFoundError:
+            pass
+    files.sort(key=lambda f: f[0].st_mtime)
+    size = sum(stat.st_size for stat, _ in files)
+    for stat, file in files:
+        if size <= CACHE_MAX_SIZE:
+            break
+        size -= stat.st_size
+        file.unlink(missing_ok=True)
+
+
+def cached(func):
+    # Persistent cache for cell functions, keyed by the content of the function
+    # and not by its name, so unchanged cells load from disk on later runs
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs) -> gf.Component:
+        if CACHE_DIR is None:
+            return func(*args, **kwargs)
+
+        k = key(func, args, kwargs)
+        # Dropped by gf.clear_cache() when constants change (params.apply)
+        if k in _loaded and not _loaded[k].destroyed():
+            return _loaded[k]
+
+        path = CACHE_DIR / f"{func.__name__}-{k[:32]}.oas"
+        c = _load(path)
+        if c is None:
+            c = func(*args, **kwargs)
+            _share(c.kdb_cell)
+            # Write to a temporary file first, parallel builds share the cache
+            tmp = CACHE_DIR / "tmp" / f"{os.getpid()}-{path.name}"
+            c.write_gds(tmp)
+            os.replace(tmp, path)
+            _evict()
+
+        _loaded[k] = c
+        return c
+
+    return wrapper
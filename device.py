@@ -4,19 +4,32 @@ import gfelib as gl
 import klayout
 
 import numpy as np
-import functools
 
+import cellcache
 from pdk import LAYERS, PDK
 
 PDK.activate()
 
-static_cell = functools.partial(gf.cell, check_instances=False)
+static_cell = lambda func: cellcache.cached(gf.cell(func, check_instances=False))
+
+
+def angle_resolution(radius: float) -> float:
+    # Angle step (deg) of an arc of the given radius (um) within MAX_SAGITTA.
+    # Steps divide 90 deg so that circles keep their symmetry
+    if MAX_SAGITTA is None:
+        return ANGLE_RESOLUTION
+    step = 2 * np.degrees(np.arccos(1 - min(MAX_SAGITTA * 1e-3 / radius, 1)))
+    return 90 / np.ceil(90 / step)
+
 
 # GLOBAL CONSTANTS
 CHIP_SIZE = 6000
 CHIP_BORDER_WIDTH = 200
 
 ANGLE_RESOLUTION = 0.5
+# Largest distance between an arc and its polygon (nm), None to use
+# ANGLE_RESOLUTION for all arcs
+MAX_SAGITTA = None
 CAVITY_WIDTH = 50
 DEVICE_MIN_ISOLATION = 7
 ELEC_ROUTING_WIDTH = 70
@@ -25,14 +38,14 @@ RELEASE_SPEC = gl.datatypes.ReleaseSpec(
     hole_radius=3,
     distance=6,
     angle_resolution=18,
-    layer=LAYERS.DEVICE_REMOVE,
+    layer=LAYERS.DEVICE_RELEASE,
 )
 
 RELEASE_SPEC_CHIP_BORDER = gl.datatypes.ReleaseSpec(
     hole_radius=3,
     distance=8,
     angle_resolution=18,
-    layer=LAYERS.DEVICE_REMOVE,
+    layer=LAYERS.DEVICE_RELEASE,
 )
 
 CENTER_CARRIAGE_RADIUS = 75
@@ -59,7 +72,7 @@ RFLEX_RELEASE_SPEC = gl.datatypes.ReleaseSpec(
     hole_radius=3,
     distance=6,
     angle_resolution=18,
-    layer=LAYERS.DEVICE_REMOVE,
+    layer=LAYERS.DEVICE_RELEASE,
 )
 RFLEX_BEAM_ANGLES = [30, 60]
 
@@ -307,7 +320,7 @@ via = lambda layer: gl.basic.via(
         LAYERS.VIAS_ETCH,
         layer,
     ],
-    angle_resolution=ANGLE_RESOLUTION,
+    angle_resolution=angle_resolution(VIA_RADIUS + VIA_DEVICE_CLEARANCE),
 )
 
 HANDLE_STEP_RADIUS = ZSTAGE_OUTER_RADIUS + 400
@@ -346,13 +359,13 @@ def center_carriage() -> gf.Component:
 
     _ = c << gf.components.circle(
         radius=CENTER_CARRIAGE_RADIUS,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(CENTER_CARRIAGE_RADIUS),
         layer=LAYERS.DEVICE_P1_NOISO,
     )
 
     _ = c << gf.components.circle(
         radius=CENTER_CARRIAGE_RADIUS,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(CENTER_CARRIAGE_RADIUS),
         layer=LAYERS.HANDLE_P1,
     )
 
@@ -390,7 +403,7 @@ def r_flexure_full() -> gf.Component:
         angles=RFLEX_BEAM_ANGLES,
         release_inner=False,
         geometry_layer=LAYERS.DEVICE_P2,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(RFLEX_ANCHOR_RADIUS0),
         beam_spec=RFLEX_BEAM_SPEC,
         release_spec=RFLEX_RELEASE_SPEC,
     )
@@ -402,7 +415,9 @@ def r_flexure_full() -> gf.Component:
         radius_outer=RFLEX_ANCHOR_RADIUS0 + RFLEX_PROTECTION_ISOLATION,
         angles=(RFLEX_CONN_ANGLE - 90, 90 - RFLEX_CONN_ANGLE),
         geometry_layer=LAYERS.DEVICE_P3,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(
+            RFLEX_ANCHOR_RADIUS0 + RFLEX_PROTECTION_ISOLATION
+        ),
         release_spec=None,
     )
 
@@ -418,7 +433,7 @@ def r_flexure_full() -> gf.Component:
         radius_outer=RFLEX_ANCHOR_RADIUS1,
         angles=(90 - RANCHOR_ANGLE, 90 + RANCHOR_ANGLE),
         geometry_layer=LAYERS.DEVICE_P2_NOISO,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(RFLEX_ANCHOR_RADIUS1),
         release_spec=None,
     )
 
@@ -428,7 +443,9 @@ def r_flexure_full() -> gf.Component:
         radius_outer=RFLEX_ANCHOR_RADIUS0 + RFLEX_PROTECTION_ISOLATION,
         angles=(90 - RANCHOR_ANGLE, 90 + RANCHOR_ANGLE),
         geometry_layer=LAYERS.DEVICE_P2,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(
+            RFLEX_ANCHOR_RADIUS0 + RFLEX_PROTECTION_ISOLATION
+        ),
         release_spec=None,
     )
 
@@ -437,7 +454,7 @@ def r_flexure_full() -> gf.Component:
         radius_outer=RFLEX_ANCHOR_RADIUS1 + R_CONNECTOR_CLEARANCE,
         angles=(90 - RANCHOR_ANGLE, 90 + RANCHOR_ANGLE),
         geometry_layer=LAYERS.DEVICE_P2,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(RFLEX_ANCHOR_RADIUS1 + R_CONNECTOR_CLEARANCE),
         release_spec=None,
     )
 
@@ -446,7 +463,7 @@ def r_flexure_full() -> gf.Component:
         radius_outer=RFLEX_ANCHOR_RADIUS1,
         angles=(90 - RANCHOR_ANGLE, 90 + RANCHOR_ANGLE),
         geometry_layer=LAYERS.HANDLE_P1,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(RFLEX_ANCHOR_RADIUS1),
         release_spec=None,
     )
 
@@ -478,7 +495,7 @@ def r_drive_half() -> gf.Component:
         inner_rotor=True,
         rotor_span=RDRIVE_ROTOR_SPAN,
         geometry_layer=LAYERS.DEVICE_P3,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(RDRIVE_OUTER_RADIUS),
         release_spec=RELEASE_SPEC,
     )
     return c
@@ -494,12 +511,12 @@ def r_connectors_half() -> gf.Component:
         - gl.utils.sagitta_offset_safe(
             radius=CENTER_CARRIAGE_RADIUS,
             chord=0,
-            angle_resolution=ANGLE_RESOLUTION,
+            angle_resolution=angle_resolution(CENTER_CARRIAGE_RADIUS),
         ),
         radius_outer=RFLEX_ANCHOR_RADIUS0 - R_CONNECTOR_CLEARANCE,
         angles=(-RFLEX_CONN_ANGLE, RFLEX_CONN_ANGLE),
         geometry_layer=LAYERS.DEVICE_P2,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(RFLEX_ANCHOR_RADIUS0 - R_CONNECTOR_CLEARANCE),
         release_spec=RELEASE_SPEC,
     )
 
@@ -509,11 +526,11 @@ def r_connectors_half() -> gf.Component:
         + gl.utils.sagitta_offset_safe(
             radius=RFLEX_ANCHOR_RADIUS0,
             chord=0,
-            angle_resolution=ANGLE_RESOLUTION,
+            angle_resolution=angle_resolution(RFLEX_ANCHOR_RADIUS0),
         ),
         angles=(-RFLEX_CONN_ANGLE, RFLEX_CONN_ANGLE),
         geometry_layer=LAYERS.DEVICE_P2_NOISO,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(RFLEX_ANCHOR_RADIUS0),
         release_spec=None,  # Solid
     )
 
@@ -524,17 +541,19 @@ def r_connectors_half() -> gf.Component:
         - gl.utils.sagitta_offset_safe(
             radius=RFLEX_ANCHOR_RADIUS1 + R_CONNECTOR_CLEARANCE,
             chord=0,
-            angle_resolution=ANGLE_RESOLUTION,
+            angle_resolution=angle_resolution(
+                RFLEX_ANCHOR_RADIUS1 + R_CONNECTOR_CLEARANCE
+            ),
         ),
         radius_outer=RDRIVE_INNER_RADIUS
         + gl.utils.sagitta_offset_safe(
             radius=RDRIVE_INNER_RADIUS,
             chord=0,
-            angle_resolution=ANGLE_RESOLUTION,
+            angle_resolution=angle_resolution(RDRIVE_INNER_RADIUS),
         ),
         angles=(-RDRIVE_ROTOR_SPAN / 2, RSENSOR_START_ANGLE),
         geometry_layer=LAYERS.DEVICE_P2_NOISO,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(RDRIVE_INNER_RADIUS),
         release_spec=RELEASE_SPEC,
     )
 
@@ -544,7 +563,7 @@ def r_connectors_half() -> gf.Component:
         radius_outer=RFLEX_ANCHOR_RADIUS1 + DEVICE_MIN_ISOLATION,
         angles=(0, RSENSOR_START_ANGLE),
         geometry_layer=LAYERS.DEVICE_REMOVE,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(RFLEX_ANCHOR_RADIUS1 + DEVICE_MIN_ISOLATION),
         release_spec=None,
     )
 
@@ -553,7 +572,7 @@ def r_connectors_half() -> gf.Component:
         radius_outer=RFLEX_ANCHOR_RADIUS0,
         angles=(-RFLEX_BEAM_ANGLES[0] * 0.75, 0),
         geometry_layer=LAYERS.DEVICE_REMOVE,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(RFLEX_ANCHOR_RADIUS0),
         release_spec=None,
     )
 
@@ -573,14 +592,14 @@ def r_connectors_half() -> gf.Component:
         radius_outer=ZSTAGE_OUTER_RADIUS,
         angles=(-90, 90),
         geometry_layer=LAYERS.HANDLE_P1,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(ZSTAGE_OUTER_RADIUS),
         release_spec=None,
     )
 
     handle_connector_inner_radius = RFLEX_ANCHOR_RADIUS1 - gl.utils.sagitta_offset_safe(
         radius=RFLEX_ANCHOR_RADIUS1,
         chord=0,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(RFLEX_ANCHOR_RADIUS1),
     )
     handle_connector_outer_radius = (
         RDRIVE_MID_RADIUS
@@ -588,7 +607,7 @@ def r_connectors_half() -> gf.Component:
         + gl.utils.sagitta_offset_safe(
             radius=RDRIVE_MID_RADIUS + 0.5 * CAVITY_WIDTH,
             chord=0,
-            angle_resolution=ANGLE_RESOLUTION,
+            angle_resolution=angle_resolution(RDRIVE_MID_RADIUS + 0.5 * CAVITY_WIDTH),
         )
     )
 
@@ -598,7 +617,7 @@ def r_connectors_half() -> gf.Component:
         radius_outer=handle_connector_outer_radius,
         angles=(-90, -90 + 0.5 * RDRIVE_ANCHOR_BASE_SPAN),
         geometry_layer=LAYERS.HANDLE_P1,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(handle_connector_outer_radius),
         release_spec=None,
     )
 
@@ -630,14 +649,14 @@ def r_sensor_half() -> gf.Component:
         + gl.utils.sagitta_offset_safe(
             radius=RDRIVE_INNER_RADIUS,
             chord=0,
-            angle_resolution=ANGLE_RESOLUTION,
+            angle_resolution=angle_resolution(RDRIVE_INNER_RADIUS),
         ),
         angles=(RSENSOR_START_ANGLE, RSENSOR_END_ANGLE),
         gap=RSENSOR_COMB_GAP,
         count=RSENSOR_COMB_COUNT,
         overlap=RSENSOR_COMB_OVERLAP,
         geometry_layer=LAYERS.DEVICE_P3_NOISO,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(RDRIVE_INNER_RADIUS),
         release_spec_a=None,
         release_spec_b=None,
     )
@@ -713,7 +732,7 @@ def electrical_interconnect() -> gf.Component:
         radius_outer=via2_radius + 0.5 * ELEC_ROUTING_WIDTH,
         angles=(-90, -85),
         geometry_layer=LAYERS.DEVICE_P4,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(via2_radius + 0.5 * ELEC_ROUTING_WIDTH),
         release_spec=None,
     )
 
@@ -722,7 +741,7 @@ def electrical_interconnect() -> gf.Component:
         radius_outer=via1_radius + 0.5 * ELEC_ROUTING_WIDTH,
         angles=(-95, -90),
         geometry_layer=LAYERS.DEVICE_P4,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(via1_radius + 0.5 * ELEC_ROUTING_WIDTH),
         release_spec=None,
     )
 
@@ -733,7 +752,7 @@ def electrical_interconnect() -> gf.Component:
         radius_outer=ZSTAGE_OUTER_RADIUS,
         angles=(-180 - RINTERCONN_VIAS_ANGLE - 1, RINTERCONN_VIAS_ANGLE + 1),
         geometry_layer=LAYERS.DEVICE_P5,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(ZSTAGE_OUTER_RADIUS),
         release_spec=None,
     )
 
@@ -742,7 +761,9 @@ def electrical_interconnect() -> gf.Component:
         radius_outer=RDRIVE_OUTER_RADIUS + DEVICE_MIN_ISOLATION + ELEC_ROUTING_WIDTH,
         angles=(-80, RDRIVE_PHASE_SPAN / 2 + 3),
         geometry_layer=LAYERS.DEVICE_P6,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(
+            RDRIVE_OUTER_RADIUS + DEVICE_MIN_ISOLATION + ELEC_ROUTING_WIDTH
+        ),
         release_spec=None,
     )
     (c << wire1)
@@ -753,7 +774,9 @@ def electrical_interconnect() -> gf.Component:
         radius_outer=RDRIVE_OUTER_RADIUS + DEVICE_MIN_ISOLATION + ELEC_ROUTING_WIDTH,
         angles=(-94, -86),
         geometry_layer=LAYERS.DEVICE_P6,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(
+            RDRIVE_OUTER_RADIUS + DEVICE_MIN_ISOLATION + ELEC_ROUTING_WIDTH
+        ),
         release_spec=None,
     )
 
@@ -764,7 +787,7 @@ def electrical_interconnect() -> gf.Component:
         radius_outer=RDRIVE_OUTER_RADIUS,
         angles=(-87, -RDRIVE_STATOR_SPAN_MIN / 2),
         geometry_layer=LAYERS.DEVICE,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(RDRIVE_OUTER_RADIUS),
         release_spec=None,
     )
     # Connect right A phase with middle crossing
@@ -773,7 +796,7 @@ def electrical_interconnect() -> gf.Component:
         radius_outer=RDRIVE_OUTER_RADIUS,
         angles=(-180 + RDRIVE_STATOR_SPAN_MIN / 2, -95),
         geometry_layer=LAYERS.DEVICE,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(RDRIVE_OUTER_RADIUS),
         release_spec=None,
     )
     # Connect right C phase routing with middle crossing
@@ -782,7 +805,9 @@ def electrical_interconnect() -> gf.Component:
         radius_outer=RDRIVE_OUTER_RADIUS + DEVICE_MIN_ISOLATION + ELEC_ROUTING_WIDTH,
         angles=(-85, -80),
         geometry_layer=LAYERS.DEVICE,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(
+            RDRIVE_OUTER_RADIUS + DEVICE_MIN_ISOLATION + ELEC_ROUTING_WIDTH
+        ),
         release_spec=None,
     )
     # Connect left A phase routing with middle crossing
@@ -791,7 +816,9 @@ def electrical_interconnect() -> gf.Component:
         radius_outer=RDRIVE_OUTER_RADIUS + DEVICE_MIN_ISOLATION + ELEC_ROUTING_WIDTH,
         angles=(-100, -93),
         geometry_layer=LAYERS.DEVICE,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(
+            RDRIVE_OUTER_RADIUS + DEVICE_MIN_ISOLATION + ELEC_ROUTING_WIDTH
+        ),
         release_spec=None,
     )
 
@@ -801,18 +828,20 @@ def electrical_interconnect() -> gf.Component:
         - gl.utils.sagitta_offset_safe(
             radius=RDRIVE_OUTER_RADIUS,
             chord=0,
-            angle_resolution=ANGLE_RESOLUTION,
+            angle_resolution=angle_resolution(RDRIVE_OUTER_RADIUS),
         ),
         radius_outer=RDRIVE_OUTER_RADIUS
         + DEVICE_MIN_ISOLATION
         + gl.utils.sagitta_offset_safe(
             radius=RDRIVE_OUTER_RADIUS + DEVICE_MIN_ISOLATION,
             chord=0,
-            angle_resolution=ANGLE_RESOLUTION,
+            angle_resolution=angle_resolution(
+                RDRIVE_OUTER_RADIUS + DEVICE_MIN_ISOLATION
+            ),
         ),
         angles=(RDRIVE_PHASE_SPAN / 2 + 1, RDRIVE_PHASE_SPAN / 2 + 3),
         geometry_layer=LAYERS.DEVICE_P3_NOISO,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(RDRIVE_OUTER_RADIUS + DEVICE_MIN_ISOLATION),
         release_spec=None,
     )
     (c << conn)
@@ -1036,7 +1065,7 @@ def z_cant() -> gf.Component:
     sub = gf.Component()
     circ = sub << gf.components.circle(
         radius=ZCANT_BOTTOM_CURVATURE,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(ZCANT_BOTTOM_CURVATURE),
         layer=LAYERS.HANDLE_P0,
     )
     circ.movex(ZCANT_POSITION - np.sqrt(ZCANT_BOTTOM_CURVATURE**2 - ZCANT_WIDTH**2 / 4))
@@ -1516,7 +1545,9 @@ def z_clamp() -> gf.Component:
         (
             carriage_half
             << gf.components.circle(
-                ZCLAMP_BUMP_RADIUS, ANGLE_RESOLUTION, layer=LAYERS.DEVICE_P3
+                ZCLAMP_BUMP_RADIUS,
+                angle_resolution(ZCLAMP_BUMP_RADIUS),
+                layer=LAYERS.DEVICE_P3,
             )
         ).move((xbump, ybump))
         xbump += 2 * ZCLAMP_BUMP_RADIUS + bump_spacing
@@ -1669,7 +1700,7 @@ def z_clamp() -> gf.Component:
             radius_outer=ZCLAMP_LOCKER_RING_OUTER_RADIUS,
             angles=(0, 360),
             geometry_layer=LAYERS.DEVICE_P3,
-            angle_resolution=ANGLE_RESOLUTION,
+            angle_resolution=angle_resolution(ZCLAMP_LOCKER_RING_OUTER_RADIUS),
             release_spec=RELEASE_SPEC,
         )
     ).move(ring1_pos)
@@ -1680,7 +1711,7 @@ def z_clamp() -> gf.Component:
         - gl.utils.sagitta_offset_safe(
             radius=ZCLAMP_LOCKER_RING_OUTER_RADIUS,
             chord=ZCLAMP_LOCKER_RACHET_SIZE[1],
-            angle_resolution=ANGLE_RESOLUTION,
+            angle_resolution=angle_resolution(ZCLAMP_LOCKER_RING_OUTER_RADIUS),
         ),
         ring1_pos[1] - ZCLAMP_LOCKER_RACHET_SIZE[1] / 2,
     )
@@ -1714,7 +1745,7 @@ def z_clamp() -> gf.Component:
         - gl.utils.sagitta_offset_safe(
             radius=ZCLAMP_LOCKER_RING_OUTER_RADIUS,
             chord=ZCLAMP_LOCKER_RACHET_SIZE[1],
-            angle_resolution=ANGLE_RESOLUTION,
+            angle_resolution=angle_resolution(ZCLAMP_LOCKER_RING_OUTER_RADIUS),
         ),
         yr3 - ZCLAMP_LOCKER_RACHET_SIZE[1] / 2,
     )
@@ -1725,7 +1756,7 @@ def z_clamp() -> gf.Component:
             radius_outer=ZCLAMP_LOCKER_RING_OUTER_RADIUS,
             angles=(0, 360),
             geometry_layer=LAYERS.DEVICE_P3,
-            angle_resolution=ANGLE_RESOLUTION,
+            angle_resolution=angle_resolution(ZCLAMP_LOCKER_RING_OUTER_RADIUS),
             release_spec=RELEASE_SPEC,
         )
     ).move(ring2_pos)
@@ -1738,7 +1769,7 @@ def z_clamp() -> gf.Component:
         + gl.utils.sagitta_offset_safe(
             radius=ZCLAMP_LOCKER_RING_OUTER_RADIUS,
             chord=ZCLAMP_LOCKER_BEAM2_WIDTH,
-            angle_resolution=ANGLE_RESOLUTION,
+            angle_resolution=angle_resolution(ZCLAMP_LOCKER_RING_OUTER_RADIUS),
         ),
     )
     beamV = gf.components.rectangle(
@@ -1825,7 +1856,9 @@ def z_clamp() -> gf.Component:
         (
             c
             << gf.components.circle(
-                ZCLAMP_BUMP_RADIUS, ANGLE_RESOLUTION, layer=LAYERS.DEVICE_P3
+                ZCLAMP_BUMP_RADIUS,
+                angle_resolution(ZCLAMP_BUMP_RADIUS),
+                layer=LAYERS.DEVICE_P3,
             )
         ).move((xbump, ybump))
         xbump += 2 * ZCLAMP_BUMP_RADIUS + bump_spacing
@@ -1879,7 +1912,9 @@ def handle_split():
         radius_outer=ZSTAGE_OUTER_RADIUS - ZCANT_ROUTING_CLEARANCE - ELEC_ROUTING_WIDTH,
         angles=(90 - HANDLE_DEVICE_SUPPORT_ANGLE, 90 + HANDLE_DEVICE_SUPPORT_ANGLE),
         geometry_layer=LAYERS.DEVICE_P7,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(
+            ZSTAGE_OUTER_RADIUS - ZCANT_ROUTING_CLEARANCE - ELEC_ROUTING_WIDTH
+        ),
         release_spec=None,
     )
 
@@ -1906,14 +1941,14 @@ def handle_split():
         + gl.utils.sagitta_offset_safe(
             radius=ZSTAGE_OUTER_RADIUS,
             chord=0,
-            angle_resolution=ANGLE_RESOLUTION,
+            angle_resolution=angle_resolution(ZSTAGE_OUTER_RADIUS),
         ),
         angles=(
             90 - HANDLE_SPLIT_ANGLE - angle_span / 2,
             90 - HANDLE_SPLIT_ANGLE + angle_span / 2,
         ),
         geometry_layer=LAYERS.HANDLE_REMOVE,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(ZSTAGE_OUTER_RADIUS),
         release_spec=None,
     )
     (c << cut)
@@ -1954,7 +1989,7 @@ def handle_step():
     c = gf.Component()
     c << gf.components.circle(
         radius=HANDLE_STEP_RADIUS,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(HANDLE_STEP_RADIUS),
         layer=LAYERS.HANDLE_STEP_ETCH,
     )
     c << gf.components.rectangle(
@@ -1971,7 +2006,7 @@ def handle_step():
 
     central_carriage = gf.components.circle(
         radius=CENTER_CARRIAGE_RADIUS,
-        angle_resolution=ANGLE_RESOLUTION,
+        angle_resolution=angle_resolution(CENTER_CARRIAGE_RADIUS),
         layer=LAYERS.DUMMY,
     )
 
@@ -1988,7 +2023,7 @@ def handle_step():
     return c
 
 
-def chip_label(ver: str):
+def chip_label():
     c = gf.Component()
 
     c << gf.components.rectangle(
@@ -2004,13 +2039,22 @@ def chip_label(ver: str):
             layer=LAYERS.DEVICE_REMOVE,
         )
 
-    c << gf.components.text(
+    return c
+
+
+# Not part of device(), so that the device and its merged layers stay the same
+# across versions
+def version_label(ver: str):
+    c = gf.Component()
+
+    text = c << gf.components.text(
         text=ver,
         size=LABEL_VERSION_SIZE,
         position=(0, LABEL_VERSION_YPOS),
         justify="center",
         layer=LAYERS.DEVICE_REMOVE,
     )
+    text.move(LABEL_POSITION)
 
     return c
 
@@ -2036,7 +2080,7 @@ def add_kirby():
 
 
 @static_cell
-def device(ver: str) -> gf.Component:
+def device() -> gf.Component:
     c = gf.Component()
 
     # Emit chip border
@@ -2078,7 +2122,7 @@ def device(ver: str) -> gf.Component:
         (c << zcl).rotate(angle)
         (c << pad).rotate(angle)
 
-    label = c << chip_label(ver)
+    label = c << chip_label()
     label.move(LABEL_POSITION)
 
     c << handle_split()
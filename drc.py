@@ -0,0 +1,138 @@
+import klayout.db as kdb
+import klayout.rdb as rdb
+
+import os
+
+# Tiles checked side by side (um)
+TILE_SIZE = 1000
+
+# Compensated distances that equal a rule land within a few dbu of it (um)
+TOLERANCE = 0.005
+
+# Layers the rules refer to besides the inputs, computed in every tile
+DERIVED = {
+    "device": "chip - device_remove",
+    "handle": "chip - handle_remove",
+}
+
+
+def rules(device, comp_device: float = 0, comp_handle: float = 0, dbu=0.001):
+    # Rule deck from the design constants of device.py. The checked layers are CD
+    # compensated: DEVICE grows and DEVICE_REMOVE shrinks by comp_device on each
+    # side, HANDLE_REMOVE shrinks by comp_handle, and the distances with them.
+    # Isolation rules only apply to removal made by the merge, not to removal as
+    # drawn or to gaps between NOISO features (combs, teeth), which are closed
+    # before checking
+    beam = min(
+        device.RFLEX_BEAM_WIDTH,
+        device.ZCLAMP_BEAM_WIDTH,
+        device.ZCLAMP_LOCKER_BEAM1_WIDTH,
+        device.ZCLAMP_LOCKER_BEAM2_WIDTH,
+        device.ZCLAMP_PFLEX_BEAM_WIDTH,
+        device.ZCANT_BEAM_MAIN_WIDTH,
+        device.ZCANT_BEAM_DRIVE_WIDTH,
+        device.ZACTUATOR_ANCHOR_BEAM_WIDTH,
+    )
+    out = [
+        (
+            "DEVICE.W.1",
+            f"DEVICE width >= {beam} um (narrowest beam)",
+            beam + 2 * comp_device,
+            "device.width_check({d})",
+        ),
+        (
+            "DEVICE.S.1",
+            f"DEVICE isolation >= {device.DEVICE_MIN_ISOLATION} um (DEVICE_MIN_ISOLATION)",
+            device.DEVICE_MIN_ISOLATION - 2 * comp_device,
+            "device_remove.width_check({d}).not_interacting(drawn_remove)"
+            ".not_inside({noiso_closed})",
+        ),
+        (
+            "DEVICE.S.2",
+            f"DEVICE isolation of the rotary flexures >= {device.RFLEX_PROTECTION_ISOLATION} um (RFLEX_PROTECTION_ISOLATION)",
+            device.RFLEX_PROTECTION_ISOLATION - 2 * comp_device,
+            "device_remove.width_check({d}).interacting(rflex.sized({comp} + 1))"
+            ".not_interacting(drawn_remove).not_inside({noiso_closed})",
+        ),
+        (
+            "HANDLE.S.1",
+            f"HANDLE_REMOVE cavity width >= {device.CAVITY_WIDTH} um (CAVITY_WIDTH)",
+            device.CAVITY_WIDTH - 2 * comp_handle,
+            "handle_remove.width_check({d}).not_interacting(drawn_handle_remove)",
+        ),
+        (
+            "VIAS.EN.1",
+            f"DEVICE encloses VIAS_ETCH by >= {device.VIA_DEVICE_CLEARANCE} um (VIA_DEVICE_CLEARANCE)",
+            device.VIA_DEVICE_CLEARANCE + comp_device,
+            "device.enclosing_check(vias, {d})",
+        ),
+        (
+            "VIAS.EN.2",
+            f"HANDLE encloses VIAS_ETCH by >= {device.VIA_HANDLE_CLEARANCE} um (VIA_HANDLE_CLEARANCE)",
+            device.VIA_HANDLE_CLEARANCE + comp_handle,
+            "handle.enclosing_check(vias, {d})",
+        ),
+    ]
+    comp = round(comp_device / dbu)
+    deck = []
+    for name, description, value, script in out:
+        d = round((value - TOLERANCE) / dbu)
+        # NOISO features as compensated, with the gaps narrower than d filled
+        h = d // 2 + 1
+        noiso_closed = f"noiso.sized({comp + h}).sized({-h})"
+        deck.append(
+            {
+                "name": name,
+                "description": description,
+                "value": value,
+                "script": script.format(d=d, comp=comp, noiso_closed=noiso_closed),
+            }
+        )
+    return deck
+
+
+def run(layers: dict, rules: list[dict], tile_size=TILE_SIZE, threads=None, dbu=0.001):
+    # layers: input name -> Region, see the rule scripts. Returns the violations
+    # of each rule as EdgePairs, in rule order
+    tp = kdb.TilingProcessor()
+    tp.dbu = dbu
+    tp.tile_size(tile_size, tile_size)
+    # Checks look no further than the largest distance past the tile
+    border = 2 * max(rule["value"] for rule in rules)
+    tp.tile_border(border, border)
+    tp.threads = threads or os.cpu_count()
+
+    for name, region in layers.items():
+        tp.input(name, region)
+    script = "".join(f"var {name} = {expr};" for name, expr in DERIVED.items())
+    out = []
+    for i, rule in enumerate(rules):
+        out.append(kdb.EdgePairs())
+        tp.output(f"o{i}", out[i])
+        script += f"_output(o{i}, {rule['script']}, true);"
+    tp.queue(script)
+    tp.execute("DRC")
+
+    # Violations touching more than one tile are found in each
+    return [
+        kdb.EdgePairs(list({str(p.normalized()): p for p in found.each()}.values()))
+        for found in out
+    ]
+
+
+def save(violations: list, rules: list[dict], path, cell_name: str, dbu=0.001):
+    # Marker database for the KLayout marker browser
+    db = rdb.ReportDatabase("DRC")
+    db.top_cell_name = cell_name
+    cell = db.create_cell(cell_name)
+    for rule, found in zip(rules, violations):
+        category = db.create_category(rule["name"])
+        category.description = rule["description"]
+        db.create_items(cell.rdb_id(), category.rdb_id(), kdb.CplxTrans(dbu), found)
+    db.save(str(path))
+
+
+def report(violations: list, rules: list[dict]):
+    print(f"{'rule':<14}{'violations':>11}  description")
+    for rule, found in zip(rules, violations):
+        print(f"{rule['name']:<14}{found.count():>11}  {rule['description']}")
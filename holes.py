@@ -0,0 +1,83 @@
+import gdsfactory as gf
+import klayout.db as kdb
+
+
+def split(region: kdb.Region, max_size: int) -> tuple[kdb.Region, kdb.Region]:
+    # Small isolated polygons (e.g. release holes) and everything else, max_size
+    # in dbu. Vertices of round holes snap to the grid, allow one dbu more
+    merged = region.merged()
+    flat = merged
+    if region.is_deep():
+        # The DeepShapeStore breaks polygons into parts, even when merged, holes are
+        # taken from the flat polygons instead
+        flat = kdb.Region(*region.begin_shapes_rec()).merged()
+    small = flat.with_bbox_max(0, max_size + 2, False).with_holes(0, False)
+    # Keeps deep regions deep, unlike a boolean with the flat holes
+    return small, merged.not_inside(small)
+
+
+def _runs(values: list[int]) -> list[tuple[int, int, int]]:
+    # (start, step, count) of equally spaced runs in sorted values
+    out = []
+    i = 0
+    while i < len(values):
+        if i + 1 == len(values):
+            out.append((values[i], 0, 1))
+            break
+        step = values[i + 1] - values[i]
+        j = i + 1
+        while j + 1 < len(values) and values[j + 1] - values[j] == step:
+            j += 1
+        out.append((values[i], step, j - i + 1))
+        i = j + 1
+    return out
+
+
+def arrays(points) -> list[tuple[int, int, int, int, int, int]]:
+    # (x, y, dx, dy, nx, ny) of regular arrays covering the points. Rows are
+    # equally spaced runs along x, rows with the same x, dx and nx are joined
+    # along y
+    rows = {}
+    for x, y in points:
+        rows.setdefault(y, []).append(x)
+
+    columns = {}
+    for y, xs in rows.items():
+        for x, dx, nx in _runs(sorted(xs)):
+            columns.setdefault((x, dx, nx), []).append(y)
+
+    out = []
+    for (x, dx, nx), ys in columns.items():
+        for y, dy, ny in _runs(sorted(ys)):
+            out.append((x, y, dx, dy, nx, ny))
+    return out
+
+
+def hole_arrays(holes: kdb.Region, layer, size: int = 0) -> gf.Component:
+    # One cell per distinct hole shape, placed as regular arrays. size is the
+    # CD compensation of the holes in dbu
+    shapes = {}
+    for polygon in holes.each():
+        origin = polygon.bbox().p1
+        shape = polygon.moved(-origin.x, -origin.y)
+        shapes.setdefault(str(shape), (shape, []))[1].append((origin.x, origin.y))
+
+    c = gf.Component()
+    for shape, points in shapes.values():
+        # Named after its own cell index, which no other cell in the layout has,
+        # so that the holes of any later call get names of their own
+        hole = gf.Component()
+        hole.name = f"release_hole_{hole.kdb_cell.cell_index()}"
+        hole.kdb_cell.shapes(gf.get_layer(layer)).insert(kdb.Region(shape).sized(size))
+        for x, y, dx, dy, nx, ny in arrays(points):
+            c.kdb_cell.insert(
+                kdb.CellInstArray(
+                    hole.kdb_cell.cell_index(),
+                    kdb.Trans(x, y),
+                    kdb.Vector(dx, 0),
+                    kdb.Vector(0, dy),
+                    nx,
+                    ny,
+                )
+            )
+    return c
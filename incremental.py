@@ -0,0 +1,142 @@
+import gdsfactory as gf
+import klayout.db as kdb
+
+import hashlib
+import json
+import pathlib
+
+import cellcache
+import merge
+import symmetry as sym
+
+# Bump to invalidate every saved state
+STATE_FORMAT = 1
+
+
+def entries(component: gf.Component) -> list[tuple[str, kdb.Box]]:
+    # (digest, bbox) of every instance in the top cell, and of the top cell's own
+    # shapes, in dbu
+    cell = component.kdb_cell
+    layout = cell.layout()
+    memo = {}
+
+    out = []
+    for inst in cell.each_inst():
+        h = hashlib.sha256(
+            cellcache.cell_digest(layout, inst.cell_index, memo).encode()
+        )
+        h.update(cellcache.placement(inst).encode())
+        out.append((h.hexdigest(), inst.bbox()))
+
+    h = hashlib.sha256()
+    bbox = kdb.Box()
+    for layer in layout.layer_indexes():
+        shapes = cell.shapes(layer)
+        if shapes.is_empty():
+            continue
+        info = layout.get_info(layer)
+        h.update(f"L{info.layer}/{info.datatype}".encode())
+        for shape in shapes.each():
+            h.update(str(shape).encode())
+            bbox += shape.bbox()
+    if not bbox.empty():
+        out.append((h.hexdigest(), bbox))
+    return out
+
+
+def dirty(previous: list, current: list) -> kdb.Region:
+    # Area covered by instances that were added, removed, changed or moved. The
+    # digest includes the placement, identical digests have identical bboxes
+    remaining = {}
+    for digest, bbox in previous:
+        remaining.setdefault(digest, []).append(bbox)
+
+    region = kdb.Region()
+    for digest, bbox in current:
+        if remaining.get(digest):
+            remaining[digest].pop()
+        else:
+            region.insert(bbox)
+    for boxes in remaining.values():
+        for bbox in boxes:
+            region.insert(bbox)
+    return region
+
+
+def patch_windows(old, windows: list[kdb.Box], new) -> merge.LayerRegions:
+    # Everything outside the windows is unaffected by the changes
+    mask = kdb.Region(windows)
+    out = merge.LayerRegions()
+    for layer in set(old) | set(new):
+        out[layer] = (old[layer] - mask) + new[layer]
+        out[layer].merge()
+    return out
+
+
+def overlay(merged: dict, stages: dict, component: gf.Component, halo: int, runner):
+    # Adds the shapes of the component to the sources of the merged stages, only
+    # merging again around the component
+    windows = sym.windows(kdb.Region(component.kdb_cell.bbox()), halo)
+    overlaid = {}
+    for name, (fn, src) in stages.items():
+        shapes = merge.layer_regions(component, list(src))
+        src = merge.LayerRegions({layer: src[layer] + shapes[layer] for layer in src})
+        overlaid[name] = (fn, src)
+
+    results = runner(overlaid, windows=windows)
+    return {
+        name: patch_windows(merged[name], windows, results[name]) for name in merged
+    }
+
+
+def _to_json(items: list) -> list:
+    return [[digest, [b.left, b.bottom, b.right, b.top]] for digest, b in items]
+
+
+def _from_json(items: list) -> list:
+    return [(digest, kdb.Box(*box)) for digest, box in items]
+
+
+def run(stages: dict, components: list, directory, halo: int, runner) -> dict:
+    # Same as runner(stages), but only the merged result around instances of the
+    # source components that changed since the last build is recomputed. Stages
+    # whose function, arguments or source layers changed are rebuilt in full
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    current = [entry for component in components for entry in entries(component)]
+    configs = {
+        name: cellcache.key(fn, (STATE_FORMAT, halo, sorted(src)), {})
+        for name, (fn, src) in stages.items()
+    }
+
+    state = {}
+    if (directory / "state.json").exists():
+        state = json.loads((directory / "state.json").read_text())
+    previous = _from_json(state.get("entries", []))
+
+    full = [
+        name
+        for name in stages
+        if state.get("configs", {}).get(name) != configs[name]
+        or not (directory / f"{name}.bin").exists()
+    ]
+    patch = [name for name in stages if name not in full]
+
+    out = {}
+    if full:
+        out |= runner({name: stages[name] for name in full})
+
+    windows = sym.windows(dirty(previous, current), halo) if patch else []
+    results = runner({name: stages[name] for name in patch}, windows=windows)
+    for name in patch:
+        old = merge.from_bytes((directory / f"{name}.bin").read_bytes())
+        out[name] = patch_windows(old, windows, results[name])
+
+    # An interrupted save leaves no state behind and the next build is a full one
+    (directory / "state.json").unlink(missing_ok=True)
+    for name, regions in out.items():
+        (directory / f"{name}.bin").write_bytes(merge.to_bytes(regions))
+    state = {"entries": _to_json(current), "configs": configs}
+    (directory / "state.json").write_text(json.dumps(state))
+    return {name: out[name] for name in stages}
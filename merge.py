@@ -0,0 +1,189 @@
+import gdsfactory as gf
+import klayout.db as kdb
+
+import os
+import pickle
+import tempfile
+
+import profiler
+
+
+class LayerRegions(dict):
+    # Regions keyed by (layer, datatype), missing layers read as empty
+
+    def __init__(self, regions=()):
+        super().__init__()
+        for layer, region in dict(regions).items():
+            self[layer] = region
+
+    @staticmethod
+    def key(layer) -> tuple[int, int]:
+        return (int(layer[0]), int(layer[1]))
+
+    def __getitem__(self, layer) -> kdb.Region:
+        return super().__getitem__(self.key(layer))
+
+    def __setitem__(self, layer, region: kdb.Region):
+        super().__setitem__(self.key(layer), region)
+
+    def __contains__(self, layer) -> bool:
+        return super().__contains__(self.key(layer))
+
+    def __missing__(self, key) -> kdb.Region:
+        return kdb.Region()
+
+
+def layer_regions(
+    component: gf.Component, layers, dss: kdb.DeepShapeStore | None = None
+) -> LayerRegions:
+    # Hierarchical (deep) regions with a DeepShapeStore, flat otherwise
+    regions = LayerRegions()
+    for layer in layers:
+        shapes = component.kdb_cell.begin_shapes_rec(gf.get_layer(layer))
+        regions[layer] = kdb.Region(shapes) if dss is None else kdb.Region(shapes, dss)
+    return regions
+
+
+def to_component(regions, name: str | None = None) -> gf.Component:
+    c = gf.Component(name=name)
+    insert(c, regions)
+    return c
+
+
+def insert(c: gf.Component, regions):
+    for layer, region in regions.items():
+        if region.is_deep():
+            # Rebuilds the hierarchy of the region below c, merged to join the
+            # parts the DeepShapeStore breaks large polygons into
+            region.merged().insert_into(
+                c.kdb_cell.layout(), c.kdb_cell.cell_index(), gf.get_layer(layer)
+            )
+        else:
+            c.kdb_cell.shapes(gf.get_layer(layer)).insert(region)
+
+
+def priority_merge(src: LayerRegions, levels, base) -> kdb.Region:
+    # levels: (layer, noiso_layer, isolation in dbu), ordered from back to front
+    merged = kdb.Region()
+    for layer, noiso_layer, isolation in levels:
+        front = src[layer]
+        # Front layer clears everything behind it within the isolation distance,
+        # same as (merged | front) - (front.sized(isolation) - front)
+        merged = (merged - front.sized(isolation)) | front | src[noiso_layer]
+    return merged | src[base]
+
+
+def border_merge(src: LayerRegions, levels, border) -> kdb.Region:
+    # levels: layers ordered from back to front, border in dbu
+    merged = kdb.Region()
+    for layer in levels:
+        front = src[layer]
+        # Front layer is kept, surrounded by a removed border of the given width,
+        # same as (merged - front) | (front.sized(border) - front)
+        merged = (merged | front.sized(border)) - front
+    return merged
+
+
+@profiler.boolean
+def device_merge(src: LayerRegions, levels, base, layer) -> LayerRegions:
+    # layer (DEVICE_REMOVE) is kept as drawn
+    return LayerRegions({base: priority_merge(src, levels, base), layer: src[layer]})
+
+
+@profiler.boolean
+def device_remove(src: LayerRegions, levels, base, chip, layer) -> LayerRegions:
+    dev = priority_merge(src, levels, base)
+    return LayerRegions({layer: (src[chip] - dev) | src[layer]})
+
+
+@profiler.boolean
+def handle_remove(src: LayerRegions, levels, border, layer, step) -> LayerRegions:
+    handle = border_merge(src, levels, border) | src[layer]
+    # The step etch must expose all handle removal features as well
+    return LayerRegions({layer: handle, step: handle | src[step]})
+
+
+@profiler.boolean
+def release(src: LayerRegions, layer, holes) -> LayerRegions:
+    # Release holes are removed on top of the merged device
+    return LayerRegions({layer: src[layer] | src[holes]})
+
+
+def released(src: LayerRegions, fn, layer, holes) -> LayerRegions:
+    # fn with the release holes of src removed on top, for merging in one pass
+    out = fn(src)
+    out[layer] = release(
+        LayerRegions({layer: out[layer], holes: src[holes]}), layer, holes
+    )[layer]
+    return out
+
+
+def compensated(src: LayerRegions, fn, sizes: dict) -> LayerRegions:
+    # fn followed by CD compensation, sizes: layer -> distance in dbu
+    out = fn(src)
+    for layer, distance in sizes.items():
+        if layer in out:
+            out[layer] = out[layer].sized(distance)
+    return out
+
+
+@profiler.boolean
+def chip_layers(src: LayerRegions, chip, positive, negative) -> LayerRegions:
+    out = LayerRegions()
+    for layer in positive:
+        out[layer] = src[chip] & src[layer]
+    for layer in negative:
+        out[layer] = src[chip] - src[layer]
+    return out
+
+
+def to_bytes(regions) -> bytes:
+    layout = kdb.Layout()
+    top = layout.create_cell("TOP")
+    holes = {}
+    for layer, region in regions.items():
+        # GDS/OASIS cannot hold polygons with holes and the writer cuts them open,
+        # rounding wherever a cut crosses an off-grid edge, so send those as is
+        top.shapes(layout.layer(*LayerRegions.key(layer))).insert(
+            region.with_holes(0, False)
+        )
+        holes[LayerRegions.key(layer)] = [
+            polygon.dup() for polygon in region.with_holes(0, True).each()
+        ]
+
+    options = kdb.SaveLayoutOptions()
+    options.format = "OASIS"
+    return pickle.dumps((layout.write_bytes(options), holes))
+
+
+def from_bytes(data: bytes) -> LayerRegions:
+    data, holes = pickle.loads(data)
+    layout = kdb.Layout()
+    layout.read_bytes(data)
+    top = layout.top_cell()
+
+    regions = LayerRegions()
+    for index in layout.layer_indexes():
+        info = layout.get_info(index)
+        # Copy the shapes, the layout goes away with this function
+        region = kdb.Region()
+        region.insert(top.begin_shapes_rec(index))
+        regions[(info.layer, info.datatype)] = region
+    for layer, polygons in holes.items():
+        regions[layer] = regions[layer] + kdb.Region(polygons)
+    return regions
+
+
+class Spilled:
+    # Layer regions kept in a temporary file until they are loaded, once
+
+    def __init__(self, regions, directory):
+        fd, self.path = tempfile.mkstemp(suffix=".bin", dir=directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(to_bytes(regions))
+
+    def load(self) -> LayerRegions:
+        with open(self.path, "rb") as f:
+            data = f.read()
+        os.remove(self.path)
+        return from_bytes(data)
@@ -0,0 +1,88 @@
+import gdsfactory as gf
+import klayout.db as kdb
+
+import concurrent.futures
+import multiprocessing
+import pathlib
+
+import profiler
+
+# Artifacts written by build.py
+ARTIFACTS = ["source", "build", "reticle"]
+
+FORMATS = {"gds": "GDS2", "oas": "OASIS"}
+
+# Forked workers inherit the components to write, same as in tiling
+_context = multiprocessing.get_context("fork")
+_items: list = []
+
+# OASIS shape compression, higher searches harder for repetitions (0 to 10)
+OASIS_COMPRESSION_LEVEL = 10
+
+
+def save_options(format: str) -> kdb.SaveLayoutOptions | None:
+    # None keeps the gdsfactory defaults
+    if format != "oas":
+        return None
+    options = kdb.SaveLayoutOptions()
+    options.format = FORMATS[format]
+    options.oasis_compression_level = OASIS_COMPRESSION_LEVEL
+    options.oasis_strict_mode = True
+    options.oasis_write_cblocks = True
+    return options
+
+
+def write(
+    component: gf.Component, path: str, format: str = "gds", with_metadata=False
+) -> pathlib.Path:
+    # path without suffix
+    return component.write_gds(
+        f"{path}.{format}",
+        save_options=save_options(format),
+        with_metadata=with_metadata,
+    )
+
+
+def write_layout(layout: kdb.Layout, path: str, format: str = "gds") -> pathlib.Path:
+    # Same as write(), for layouts outside of gdsfactory
+    layout.write(f"{path}.{format}", save_options(format) or kdb.SaveLayoutOptions())
+    return pathlib.Path(f"{path}.{format}")
+
+
+def _write_task(i: int, flatten: bool, name: str):
+    component, path, format = _items[i]
+    with profiler.phase(name):
+        if flatten:
+            component.flatten()
+        write(component, path, format)
+
+
+def _write_task_events(i: int, flatten: bool, name: str) -> list[dict]:
+    _write_task(i, flatten, name)
+    return profiler.take()
+
+
+def write_all(items, flatten=False, jobs=None, name="write"):
+    # (component, path, format) items, each flattened and written in a worker
+    # process unless jobs is 1
+    global _items
+    _items = list(items)
+    try:
+        if jobs == 1:
+            for i in range(len(_items)):
+                _write_task(i, flatten, name)
+            return
+        # Forked workers start with the events of this process, which are dropped
+        # so that only their own come back
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, mp_context=_context, initializer=profiler.take
+        ) as pool:
+            for events in pool.map(
+                _write_task_events,
+                range(len(_items)),
+                [flatten] * len(_items),
+                [name] * len(_items),
+            ):
+                profiler.extend(events)
+    finally:
+        _items = []
@@ -0,0 +1,84 @@
+import gdsfactory as gf
+
+import ast
+import contextlib
+import inspect
+import itertools
+
+
+def _constants(module) -> list[tuple[list[str], ast.stmt]]:
+    # Top level assignments of UPPER_CASE names, in order
+    out = []
+    for node in ast.parse(inspect.getsource(module)).body:
+        if isinstance(node, ast.Assign):
+            targets = node.targets
+        elif isinstance(node, ast.AnnAssign):
+            targets = [node.target]
+        else:
+            continue
+        names = [target.id for target in targets if isinstance(target, ast.Name)]
+        if names and all(name.isupper() for name in names):
+            out.append((names, node))
+    return out
+
+
+def parse(items: list[str]) -> dict:
+    # NAME=VALUE pairs, values are Python literals
+    values = {}
+    for item in items:
+        name, _, value = item.partition("=")
+        values[name.strip()] = ast.literal_eval(value.strip())
+    return values
+
+
+def grid(items: list[str]) -> list[dict]:
+    # NAME=VALUE,VALUE,... axes, one set of values per combination
+    axes = []
+    for item in items:
+        name, _, values = item.partition("=")
+        axes.append(
+            [(name.strip(), value) for value in ast.literal_eval(f"[{values}]")]
+        )
+    return [dict(combination) for combination in itertools.product(*axes)]
+
+
+def check(module, values: dict):
+    unknown = set(values) - {name for names, _ in _constants(module) for name in names}
+    if unknown:
+        raise ValueError(f"Unknown constants in {module.__name__}: {sorted(unknown)}")
+
+
+def apply(module, values: dict):
+    # Sets constants of the module, the constants derived from them (e.g.
+    # RDRIVE_TEETH_COUNT from RDRIVE_TEETH_PITCH) are computed again. Cells are
+    # cached by name and arguments only, so all of them are dropped
+    if not values:
+        return
+
+    constants = _constants(module)
+    check(module, values)
+
+    namespace = vars(module)
+    for names, node in constants:
+        if any(name in values for name in names):
+            namespace.update({name: values[name] for name in names if name in values})
+        else:
+            code = compile(
+                ast.Module(body=[node], type_ignores=[]), module.__file__, "exec"
+            )
+            exec(code, namespace)
+    gf.clear_cache()
+
+
+@contextlib.contextmanager
+def override(module, values: dict):
+    # Same as apply(), restores the constants on exit
+    saved = {
+        name: vars(module)[name] for names, _ in _constants(module) for name in names
+    }
+    apply(module, values)
+    try:
+        yield module
+    finally:
+        vars(module).update(saved)
+        gf.clear_cache()
@@ -13,6 +13,7 @@ class LAYERS(gf.technology.LayerMap):
     DEVICE_P6: gf.typings.Layer = (3, 6)
     DEVICE_P7: gf.typings.Layer = (3, 7)  # Lowest priority (back)
     DEVICE_REMOVE: gf.typings.Layer = (2, 0)
+    DEVICE_RELEASE: gf.typings.Layer = (2, 1)  # Release holes, part of DEVICE_REMOVE
 
     # No isolation
     DEVICE_P0_NOISO: gf.typings.Layer = (3, 10)  # Highest priority (front)
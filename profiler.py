@@ -0,0 +1,135 @@
+import contextlib
+import functools
+import json
+import os
+import resource
+import time
+
+# Disabled unless enabled with build.py --profile
+ENABLED = False
+
+_events: list[dict] = []
+
+
+def _cpu() -> float:
+    # Workers count once they are joined
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def peak_rss() -> int:
+    # ru_maxrss is in kB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) * 1024
+
+
+def rss() -> int:
+    # Resident memory now, the peak where /proc is not available
+    try:
+        pages = int(open("/proc/self/statm").read().split()[1])
+    except OSError:
+        return peak_rss()
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def counts(regions) -> tuple[int, int]:
+    # Polygons and vertices
+    polygons = vertices = 0
+    for region in regions:
+        for polygon in region.each():
+            polygons += 1
+            vertices += polygon.num_points()
+    return polygons, vertices
+
+
+@contextlib.contextmanager
+def phase(name: str, inputs=None, **args):
+    # Records wall time, CPU time and peak RSS, and the polygons and vertices of
+    # the input regions and of the regions set as "outputs" in the yielded dict.
+    # Counting is not part of the timing
+    if not ENABLED:
+        yield args
+        return
+
+    if inputs is not None:
+        args["polygons_in"], args["vertices_in"] = counts(inputs)
+    start, cpu = time.perf_counter(), _cpu()
+    try:
+        yield args
+    finally:
+        end = time.perf_counter()
+        args["cpu"] = _cpu() - cpu
+        args["peak_rss"] = peak_rss()
+        if "outputs" in args:
+            args["polygons_out"], args["vertices_out"] = counts(args.pop("outputs"))
+        _events.append(
+            {
+                "name": name,
+                "ph": "X",
+                "pid": os.getpid(),
+                "tid": 0,
+                "ts": start * 1e6,
+                "dur": (end - start) * 1e6,
+                "args": args,
+            }
+        )
+
+
+def boolean(func):
+    # Profiles a layer pipeline
+    @functools.wraps(func)
+    def wrapper(src, *args, **kwargs):
+        with phase(func.__name__, inputs=src.values()) as p:
+            out = func(src, *args, **kwargs)
+            p["outputs"] = out.values()
+        return out
+
+    return wrapper
+
+
+def take() -> list[dict]:
+    # Events recorded so far, e.g. to send them back from a worker
+    global _events
+    events, _events = _events, []
+    return events
+
+
+def extend(events: list[dict]):
+    _events.extend(events)
+
+
+def totals(events: list[dict]) -> dict:
+    # Per phase name
+    out = {}
+    for event in events:
+        total = out.setdefault(event["name"], {"calls": 0, "wall": 0, "cpu": 0})
+        total["calls"] += 1
+        total["wall"] += event["dur"] / 1e6
+        total["cpu"] += event["args"]["cpu"]
+        total["peak_rss"] = max(total.get("peak_rss", 0), event["args"]["peak_rss"])
+        for key in ["polygons_in", "vertices_in", "polygons_out", "vertices_out"]:
+            total[key] = total.get(key, 0) + event["args"].get(key, 0)
+    return out
+
+
+def report(path):
+    # Table on stdout and a Chrome trace (chrome://tracing, ui.perfetto.dev)
+    if not ENABLED:
+        return
+
+    print(
+        f"{'phase':<24}{'calls':>7}{'wall (s)':>10}{'cpu (s)':>10}{'peak (MB)':>11}"
+        f"{'poly in':>11}{'vert in':>12}{'poly out':>11}{'vert out':>12}"
+    )
+    for name, total in totals(_events).items():
+        print(
+            f"{name:<24}{total['calls']:>7}{total['wall']:>10.2f}{total['cpu']:>10.2f}"
+            f"{total['peak_rss'] / 1024**2:>11.0f}"
+            f"{total['polygons_in']:>11}{total['vertices_in']:>12}"
+            f"{total['polygons_out']:>11}{total['vertices_out']:>12}"
+        )
+
+    with open(path, "w") as f:
+        json.dump({"traceEvents": _events, "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,92 @@
+import gdsfactory as gf
+import klayout.db as kdb
+
+import merge
+from merge import LayerRegions
+
+
+def die_ids(placements, pitch: float) -> list[tuple[int, int, int]]:
+    # (row, column, serial) of each die, rows from the top and columns from the
+    # left of the wafer, serials in placement order from 1
+    top = max(y for _, y in placements)
+    left = min(x for x, _ in placements)
+    return [
+        (round((top - y) / pitch), round((x - left) / pitch), i + 1)
+        for i, (x, y) in enumerate(placements)
+    ]
+
+
+def patches(
+    stages: dict,
+    labels: list[gf.Component],
+    offsets: list[kdb.Vector],
+    window: kdb.Box,
+    pitch: int,
+    halo: int,
+    runner,
+) -> list[LayerRegions]:
+    # The window of every die merged again with its own label, in one run over a
+    # copy of the window sources per die. Labels and window in die coordinates,
+    # offsets, pitch and halo in dbu. Returns the windows in die coordinates
+    frame = kdb.Region(window.enlarged(halo, halo))
+    batched = {}
+    for name, (fn, src) in stages.items():
+        local = {layer: src[layer] & frame for layer in src}
+        batch = LayerRegions()
+        for label, offset in zip(labels, offsets):
+            shapes = merge.layer_regions(label, list(src))
+            for layer in src:
+                batch[layer] += (local[layer] + shapes[layer]).moved(offset)
+        batched[name] = (fn, batch)
+
+    results = runner(
+        batched, windows=[window.moved(offset) for offset in offsets], halo=halo
+    )
+
+    # Windows are a pitch apart, each polygon goes to the die it is closest to
+    dies = {
+        (round(offset.x / pitch), round(offset.y / pitch)): i
+        for i, offset in enumerate(offsets)
+    }
+    center = window.center()
+    polygons = [{} for _ in offsets]
+    for regions in results.values():
+        for layer, region in regions.items():
+            for polygon in region.each():
+                p = polygon.bbox().center() - center
+                i = dies[(round(p.x / pitch), round(p.y / pitch))]
+                polygons[i].setdefault(layer, []).append(polygon.moved(-offsets[i]))
+    return [
+        LayerRegions({layer: kdb.Region(items) for layer, items in die.items()})
+        for die in polygons
+    ]
+
+
+def wafer(
+    chip: gf.Component,
+    window: kdb.Box,
+    windows: list[LayerRegions],
+    offsets: list[kdb.Vector],
+    names: list[str],
+    name: str = "WAFER",
+) -> kdb.Layout:
+    # The chip outside the window is stored once, each die adds its own window
+    source = chip.kdb_cell.layout()
+    layout = kdb.Layout()
+    layout.dbu = source.dbu
+    top = layout.cell(layout.add_cell(name))
+
+    base = layout.cell(layout.add_cell(f"{name}_CHIP"))
+    cut = kdb.Region(window)
+    for index in source.layer_indexes():
+        region = kdb.Region(chip.kdb_cell.begin_shapes_rec(index))
+        if not region.is_empty():
+            base.shapes(layout.layer(source.get_info(index))).insert(region - cut)
+
+    for die_name, regions, offset in zip(names, windows, offsets):
+        die = layout.cell(layout.add_cell(die_name))
+        die.insert(kdb.CellInstArray(base.cell_index(), kdb.Trans()))
+        for layer, region in regions.items():
+            die.shapes(layout.layer(*layer)).insert(region)
+        top.insert(kdb.CellInstArray(die.cell_index(), kdb.Trans(offset)))
+    return layout
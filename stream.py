@@ -0,0 +1,103 @@
+import klayout.db as kdb
+
+import datetime
+import math
+import struct
+
+# GDSII records (type, data type)
+HEADER = 0x0002
+BGNLIB = 0x0102
+LIBNAME = 0x0206
+UNITS = 0x0305
+ENDLIB = 0x0400
+BGNSTR = 0x0502
+STRNAME = 0x0606
+ENDSTR = 0x0700
+BOUNDARY = 0x0800
+LAYER = 0x0D02
+DATATYPE = 0x0E02
+XY = 0x1003
+ENDEL = 0x1100
+
+# Points of an XY record, closing point included, are limited by its length,
+# which strict readers take as signed 16 bit, larger polygons are broken up
+MAX_VERTICES = 4000
+
+
+def _real8(value: float) -> bytes:
+    # GDSII excess-64 base-16 floating point
+    if value == 0:
+        return bytes(8)
+    sign = 0x80 if value < 0 else 0
+    value = abs(value)
+    exponent = math.ceil(math.log(value, 16))
+    mantissa = value / 16.0**exponent
+    if mantissa >= 1:
+        mantissa /= 16
+        exponent += 1
+    return struct.pack(">Q", (sign | (exponent + 64)) << 56 | int(mantissa * 2**56))
+
+
+def _name(name: str) -> bytes:
+    data = name.encode("ascii")
+    return data + b"\0" * (len(data) % 2)
+
+
+class GdsWriter:
+    # Writes a GDSII file record by record: cells are opened, filled with regions
+    # as they become available and closed, nothing is kept in memory
+
+    def __init__(self, path, dbu: float = 0.001, library: str = "LIB"):
+        self.file = open(path, "wb")
+        self.dbu = dbu
+        now = datetime.datetime.now().timetuple()[:6]
+        self.record(HEADER, struct.pack(">h", 600))
+        self.record(BGNLIB, struct.pack(">12h", *now, *now))
+        self.record(LIBNAME, _name(library))
+        self.record(UNITS, _real8(dbu) + _real8(dbu * 1e-6))
+
+    def record(self, kind: int, data: bytes = b""):
+        self.file.write(struct.pack(">HH", len(data) + 4, kind) + data)
+
+    def begin_cell(self, name: str):
+        now = datetime.datetime.now().timetuple()[:6]
+        self.record(BGNSTR, struct.pack(">12h", *now, *now))
+        self.record(STRNAME, _name(name))
+
+    def end_cell(self):
+        self.record(ENDSTR)
+
+    def region(self, layer, region: kdb.Region):
+        # Holes are cut open, same as the KLayout writer
+        layer, datatype = layer
+        for polygon in region.each():
+            points = list(polygon.resolved_holes().each_point_hull())
+            points.append(points[0])
+            if len(points) > MAX_VERTICES:
+                # Cutting the holes open adds two points per hole, at most two
+                # thirds of the hole points, so the parts fit once resolved
+                self.region(
+                    (layer, datatype),
+                    kdb.Region(polygon).break_(MAX_VERTICES * 3 // 5 - 1, 0),
+                )
+                continue
+            self.record(BOUNDARY)
+            self.record(LAYER, struct.pack(">h", layer))
+            self.record(DATATYPE, struct.pack(">h", datatype))
+            self.record(
+                XY,
+                struct.pack(
+                    f">{2 * len(points)}i", *(c for p in points for c in (p.x, p.y))
+                ),
+            )
+            self.record(ENDEL)
+
+    def close(self):
+        self.record(ENDLIB)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
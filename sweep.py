@@ -0,0 +1,132 @@
+import argparse
+import concurrent.futures
+import csv
+import datetime
+import json
+import os
+import pathlib
+import shlex
+import subprocess
+import sys
+import time
+
+import params
+
+OUTPUT_DIR = "./build/sweep"
+
+# Shared by all variants, cells that read none of the swept constants are only
+# built once
+CACHE_DIR = "./build/.cellcache"
+
+
+def variants(args) -> list[dict]:
+    # Every combination of the --grid axes, then the --list file (a JSON list of
+    # NAME: VALUE objects)
+    out = params.grid(args.grid) if args.grid else []
+    if args.list:
+        out += json.loads(pathlib.Path(args.list).read_text())
+    return out
+
+
+def build(version: str, values: dict, args) -> dict:
+    # One build.py process per variant, its constants are fixed on the command line
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "build.py", "--version", version, "--jobs", "1"]
+        + ["--cache-dir", args.cache_dir]
+        + [f"--set={name}={value!r}" for name, value in values.items()]
+        + shlex.split(args.build_args),
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - start
+
+    log = pathlib.Path(OUTPUT_DIR) / f"{version}.log"
+    log.write_text(result.stdout + result.stderr)
+    outputs = sorted(pathlib.Path("./build").glob(f"mega_2d_{version}_*_BUILD.*"))
+    return {
+        "variant": version,
+        **{name: repr(value) for name, value in values.items()},
+        "status": "ok" if result.returncode == 0 else f"failed ({log})",
+        "wall": round(wall, 1),
+        "size_mb": round(outputs[-1].stat().st_size / 1024**2, 2) if outputs else "",
+        "output": str(outputs[-1]) if outputs else "",
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parameter sweeps for MEGA-2D")
+    parser.add_argument(
+        "--name",
+        action="store",
+        type=str,
+        help="Sweep name, variants are built as version NAME-001, NAME-002, ...",
+        required=True,
+    )
+    parser.add_argument(
+        "--grid",
+        action="store",
+        nargs="+",
+        metavar="NAME=VALUE,VALUE,...",
+        help="device.py constants to sweep (Python literals), every combination is built",
+        default=[],
+    )
+    parser.add_argument(
+        "--list",
+        action="store",
+        type=str,
+        help="JSON file with a list of variants, each an object of device.py constants",
+        default=None,
+    )
+    parser.add_argument(
+        "--jobs",
+        action="store",
+        type=int,
+        help="Variants built at the same time (default: all cores)",
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "--build-args",
+        action="store",
+        type=str,
+        help='Extra build.py arguments, e.g. "--no-merge --oasis"',
+        default="",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        action="store",
+        type=str,
+        help="Cell cache shared by the variants",
+        default=CACHE_DIR,
+    )
+    args = parser.parse_args()
+
+    todo = variants(args)
+    if not todo:
+        parser.error("nothing to sweep, give --grid or --list")
+
+    # Typos fail here instead of in every build
+    import device
+
+    params.check(device, {name: None for values in todo for name in values})
+
+    pathlib.Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
+    versions = [f"{args.name}-{i + 1:03d}" for i in range(len(todo))]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        results = []
+        for result in pool.map(build, versions, todo, [args] * len(todo)):
+            print(
+                f"{result['variant']:<24}{result['wall']:>8.1f} s  {result['status']}"
+            )
+            results.append(result)
+
+    columns = list(dict.fromkeys(key for result in results for key in result))
+    summary = pathlib.Path(OUTPUT_DIR) / f"{args.name}_{datetime.date.today()}.csv"
+    with open(summary, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, restval="")
+        writer.writeheader()
+        writer.writerows(results)
+    print(
+        f"{sum(r['status'] == 'ok' for r in results)}/{len(results)} built, {summary}"
+    )
+    sys.exit(0 if all(r["status"] == "ok" for r in results) else 1)
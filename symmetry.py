@@ -0,0 +1,82 @@
+import klayout.db as kdb
+
+from merge import LayerRegions
+
+# Symmetry groups about the chip center (0, 0): transformations and whether the
+# fundamental domain is limited to x >= 0 and/or y >= 0
+GROUPS = {
+    "c4": ([kdb.Trans.R0, kdb.Trans.R90, kdb.Trans.R180, kdb.Trans.R270], (1, 1)),
+    "d2": ([kdb.Trans.R0, kdb.Trans.M90, kdb.Trans.M0, kdb.Trans.R180], (1, 1)),
+    "c2": ([kdb.Trans.R0, kdb.Trans.R180], (0, 1)),
+    "mirror_x": ([kdb.Trans.R0, kdb.Trans.M90], (1, 0)),
+    "mirror_y": ([kdb.Trans.R0, kdb.Trans.M0], (0, 1)),
+}
+
+
+def domain(bbox: kdb.Box, group: str) -> kdb.Box:
+    _, (x, y) = GROUPS[group]
+    m = max(abs(bbox.left), abs(bbox.right), abs(bbox.bottom), abs(bbox.top))
+    return kdb.Box(0 if x else -m, 0 if y else -m, m, m)
+
+
+def windows(asym: kdb.Region, halo: int) -> list[kdb.Box]:
+    # Boxes covering every point within the halo of an asymmetric feature, the
+    # bounding boxes of one merge of the feature boxes. These are snapped out to a
+    # grid of the halo first, so that dense features merge as few distinct boxes.
+    # The result can overlap, which is merged twice but joins no further boxes
+    g = max(halo, 1)
+    boxes = set()
+    for polygon in asym.each():
+        box = polygon.bbox()
+        boxes.add(
+            kdb.Box(
+                (box.left - halo) // g * g,
+                (box.bottom - halo) // g * g,
+                -((-box.right - halo) // g) * g,
+                -((-box.top - halo) // g) * g,
+            )
+        )
+    return [polygon.bbox() for polygon in kdb.Region(list(boxes)).each_merged()]
+
+
+def _asymmetry(src: LayerRegions, trans, limit: int):
+    # Points where a layer differs from its transformed self, or None as soon as
+    # one layer alone differs by more than the limit area
+    out = kdb.Region()
+    for region in src.values():
+        diff = region ^ region.transformed(trans)
+        if diff.area() > limit:
+            return None
+        out += diff
+    return out
+
+
+def plan(src: LayerRegions, bbox: kdb.Box, halo: int, symmetry: str):
+    # Returns (group, domain, windows) with the least area to merge, or None if
+    # merging the full die is cheaper
+    groups = list(GROUPS) if symmetry == "auto" else [symmetry]
+
+    best = None
+    cost = bbox.area()
+    asym = {}
+    for group in groups:
+        area = domain(bbox, group)
+        # The windows cover at least the asymmetric area, a group is given up
+        # as soon as that is more than it could save
+        limit = cost - area.area()
+        if limit <= 0:
+            continue
+        parts = []
+        for trans in GROUPS[group][0][1:]:
+            # Given up transformations stay given up, the cost only goes down
+            if trans not in asym:
+                asym[trans] = _asymmetry(src, trans, limit)
+            if asym[trans] is None:
+                break
+            parts.append(asym[trans])
+        else:
+            boxes = windows(sum(parts, kdb.Region()), halo)
+            area_cost = area.area() + sum(box.area() for box in boxes)
+            if area_cost < cost:
+                best, cost = (group, area, boxes), area_cost
+    return best
@@ -0,0 +1,159 @@
+import gdsfactory as gf
+import klayout.db as kdb
+
+import argparse
+import concurrent.futures
+import datetime
+import json
+import math
+import os
+import pathlib
+import sys
+
+import cellcache
+import output
+import params
+import sweep
+
+OUTPUT_DIR = "./build"
+
+# Space between dies (um)
+STREET_WIDTH = 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Test dies of MEGA-2D variants on one layout, sharing identical cells"
+    )
+    parser.add_argument(
+        "--name",
+        action="store",
+        type=str,
+        help="Layout name, variants are built as version NAME-001, NAME-002, ...",
+        required=True,
+    )
+    parser.add_argument(
+        "--grid",
+        action="store",
+        nargs="+",
+        metavar="NAME=VALUE,VALUE,...",
+        help="device.py constants to vary (Python literals), one die per combination",
+        default=[],
+    )
+    parser.add_argument(
+        "--list",
+        action="store",
+        type=str,
+        help="JSON file with a list of variants, each an object of device.py constants",
+        default=None,
+    )
+    parser.add_argument(
+        "--columns",
+        action="store",
+        type=int,
+        help="Dies per row (default: square grid)",
+        default=None,
+    )
+    parser.add_argument(
+        "--street",
+        action="store",
+        type=float,
+        help="Space between dies (um)",
+        default=STREET_WIDTH,
+    )
+    parser.add_argument(
+        "--jobs",
+        action="store",
+        type=int,
+        help="Variants built at the same time (default: all cores)",
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "--build-args",
+        action="store",
+        type=str,
+        help='Extra build.py arguments, e.g. "--no-drc"',
+        default="",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        action="store",
+        type=str,
+        help="Cell cache shared by the variants, cells that read none of the varied constants are only built once",
+        default=sweep.CACHE_DIR,
+    )
+    parser.add_argument(
+        "--oasis",
+        action="store_true",
+        help="Write OASIS instead of GDS",
+    )
+    args = parser.parse_args()
+
+    todo = sweep.variants(args)
+    if not todo:
+        parser.error("no variants, give --grid or --list")
+
+    import device
+
+    params.check(device, {name: None for values in todo for name in values})
+
+    # Every unique variant is merged once by build.py, with the cell hierarchy
+    # kept so that cells the variants have in common can be shared
+    unique = list(dict.fromkeys(json.dumps(values, sort_keys=True) for values in todo))
+    versions = [f"{args.name}-{i + 1:03d}" for i in range(len(unique))]
+    args.build_args = f"--hierarchical {args.build_args}"
+    pathlib.Path(sweep.OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        builds = dict(
+            zip(
+                unique,
+                pool.map(
+                    sweep.build,
+                    versions,
+                    [json.loads(values) for values in unique],
+                    [args] * len(unique),
+                ),
+            )
+        )
+    failed = [build for build in builds.values() if build["status"] != "ok"]
+    for build in failed:
+        print(f"{build['variant']:<24}{build['status']}")
+    if failed:
+        sys.exit(1)
+
+    target = kdb.Layout()
+    target.dbu = gf.kcl.dbu
+    top = target.cell(target.add_cell(f"{args.name}_TESTDIE"))
+    cells = {}
+    dies = {}
+    copied = 0
+
+    columns = args.columns or math.ceil(math.sqrt(len(todo)))
+    pitch = round((device.CHIP_SIZE + args.street) / target.dbu)
+    rows = math.ceil(len(todo) / columns)
+    for i, values in enumerate(todo):
+        build = builds[json.dumps(values, sort_keys=True)]
+        if build["variant"] not in dies:
+            die = kdb.Layout()
+            die.read(build["output"])
+            chip = die.top_cell()
+            copied += 1 + len(chip.called_cells())
+            dies[build["variant"]] = cellcache.copy_cell(
+                die, chip.cell_index(), target, cells
+            )
+
+        # Row by row from the top left, centered on the origin
+        row, column = divmod(i, columns)
+        x = round((column - (columns - 1) / 2) * pitch)
+        y = round(((rows - 1) / 2 - row) * pitch)
+        top.insert(kdb.CellInstArray(dies[build["variant"]], kdb.Trans(x, y)))
+        print(f"{build['variant']:<24}{json.dumps(values)}")
+
+    format = "oas" if args.oasis else "gds"
+    path = pathlib.Path(OUTPUT_DIR) / f"{args.name}_{datetime.date.today()}_TESTDIE"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    output.write_layout(target, str(path), format)
+
+    print(
+        f"{len(todo)} dies, {target.cells() - 1} unique cells of {copied}, {path}.{format}"
+    )
@@ -0,0 +1,191 @@
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+
+import klayout.db as kdb
+
+import merge
+import profiler
+import symmetry as sym
+from merge import LayerRegions
+
+# build.py is a flat script that spawned workers would re-run, so workers are
+# forked and inherit the stages and their source regions instead of a copy
+_context = multiprocessing.get_context("fork")
+_stages: dict = {}
+
+
+# Memory a worker needs for a tile, a fixed part and a part per source vertex in
+# the tile and its halo (bytes, measured on merge.device_remove with margin)
+WORKER_BYTES = 8 * 1024**2
+VERTEX_BYTES = 200
+
+
+def tiles(bbox: kdb.Box, size: int) -> list[kdb.Box]:
+    nx = max(1, -(-bbox.width() // size))
+    ny = max(1, -(-bbox.height() // size))
+    return [
+        kdb.Box(
+            bbox.left + ix * size,
+            bbox.bottom + iy * size,
+            min(bbox.left + (ix + 1) * size, bbox.right),
+            min(bbox.bottom + (iy + 1) * size, bbox.top),
+        )
+        for iy in range(ny)
+        for ix in range(nx)
+    ]
+
+
+def _densest(src: dict, size: int, halo: int) -> int:
+    # Source vertices of the fullest tile and its halo, polygons counted in the
+    # tile of their center
+    bins = {}
+    for region in src.values():
+        for polygon in region.each():
+            center = polygon.bbox().center()
+            key = (center.x // size, center.y // size)
+            bins[key] = bins.get(key, 0) + polygon.num_points()
+    return round(max(bins.values(), default=0) * ((size + 2 * halo) / size) ** 2)
+
+
+def fit(src: dict, tile_size: int, halo: int, jobs: int, budget: int):
+    # (tile_size, jobs) that merge src within budget bytes: as many workers as
+    # fit, smaller tiles if not even one does. One worker with the smallest tiles
+    # is the best that can be done, even if over the budget
+    while True:
+        need = WORKER_BYTES + _densest(src, tile_size, halo) * VERTEX_BYTES
+        if need <= budget or tile_size <= halo:
+            return tile_size, max(1, min(jobs, budget // need))
+        tile_size //= 2
+
+
+def _run_task(name, tile: kdb.Box | None, halo: int) -> LayerRegions:
+    fn, src = _stages[name]
+    if tile is None:
+        return fn(src)
+
+    frame = kdb.Region(tile.enlarged(halo, halo))
+    src = LayerRegions({layer: region & frame for layer, region in src.items()})
+
+    # Only the tile itself is exact, the halo is context for the sizing steps
+    clip = kdb.Region(tile)
+    return LayerRegions({layer: region & clip for layer, region in fn(src).items()})
+
+
+def _run_task_bytes(name, tile: kdb.Box | None, halo: int) -> tuple[bytes, list]:
+    return merge.to_bytes(_run_task(name, tile, halo)), profiler.take()
+
+
+def _results(tasks: list, halo: int, jobs):
+    # Task results in task order, as they come in. A single task gains nothing
+    # from a worker and would only pay for sending its result back
+    if jobs == 1 or len(tasks) == 1:
+        for name, _, tile in tasks:
+            yield _run_task(name, tile, halo)
+        return
+
+    # Forked workers start with the events of this process, which are dropped
+    # so that only their own come back
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs, mp_context=_context, initializer=profiler.take
+    ) as pool:
+        # Two tasks per worker in flight, finished tiles do not pile up here while
+        # an earlier one is still running
+        window = 2 * (jobs or os.cpu_count())
+        pending = collections.deque()
+        for name, _, tile in tasks:
+            pending.append(pool.submit(_run_task_bytes, name, tile, halo))
+            if len(pending) >= window:
+                yield _received(pending.popleft())
+        while pending:
+            yield _received(pending.popleft())
+
+
+def _received(future) -> LayerRegions:
+    data, events = future.result()
+    profiler.extend(events)
+    return merge.from_bytes(data)
+
+
+def run(
+    stages: dict,
+    tile_size=None,
+    halo=0,
+    jobs=None,
+    symmetry=None,
+    windows=None,
+    sink=None,
+) -> dict | None:
+    # stages: name -> (fn, src), fn maps source regions to output regions and
+    # must not size by more than the halo. tile_size and halo in dbu. With
+    # windows, only the result inside these boxes is computed and returned.
+    # With sink, sink(name, regions) gets the result of each tile as soon as it
+    # is done instead, the tiles are not stitched and symmetry is not used
+    tasks = []
+    plans = {}
+    for name, (fn, src) in stages.items():
+        # Sizing can grow the result past the inputs by up to the halo
+        bbox = kdb.Box()
+        for region in src.values():
+            bbox += region.bbox()
+        bbox = bbox.enlarged(halo, halo)
+
+        areas = [("die", bbox)]
+        if windows is not None:
+            areas = [("window", box) for box in windows]
+        elif symmetry and sink is None:
+            plans[name] = sym.plan(src, bbox, halo, symmetry)
+        if plans.get(name):
+            # Merge one fundamental domain, and the full die only around the
+            # features that break the symmetry
+            _, domain, boxes = plans[name]
+            areas = [("domain", domain)] + [("window", box) for box in boxes]
+
+        for part, area in areas:
+            if not tile_size and part == "die":
+                tasks.append((name, part, None))
+            elif not tile_size:
+                tasks.append((name, part, area))
+            else:
+                tasks += [(name, part, tile) for tile in tiles(area, tile_size)]
+
+    global _stages
+    _stages = stages
+    try:
+        if sink is not None:
+            for (name, _, _), regions in zip(tasks, _results(tasks, halo, jobs)):
+                sink(name, regions)
+            return None
+        results = list(_results(tasks, halo, jobs))
+    finally:
+        _stages = {}
+
+    # Stitch, tiles touch along their borders and merge back into single polygons.
+    # Slanted edges keep the grid point they were cut at, up to 1 dbu off the edge
+    parts = {name: {} for name in stages}
+    for (name, part, _), regions in zip(tasks, results):
+        acc = parts[name].setdefault(part, LayerRegions())
+        for layer, region in regions.items():
+            acc[layer] = acc[layer] + region
+
+    out = {}
+    for name in stages:
+        if plans.get(name):
+            group, _, boxes = plans[name]
+            domain = parts[name].get("domain", LayerRegions())
+            window = parts[name].get("window", LayerRegions())
+            out[name] = LayerRegions()
+            for layer in set(domain) | set(window):
+                region = kdb.Region()
+                for trans in sym.GROUPS[group][0]:
+                    region += domain[layer].transformed(trans)
+                out[name][layer] = (region - kdb.Region(boxes)) + window[layer]
+        elif windows is not None:
+            out[name] = parts[name].get("window", LayerRegions())
+        else:
+            out[name] = parts[name].get("die", LayerRegions())
+
+        for region in out[name].values():
+            region.merge()
+    return out
@@ -0,0 +1,92 @@
+import gdsfactory as gf
+import klayout.db as kdb
+
+import collections
+
+# Largest polygons listed in the report, and source cells listed per polygon
+REPORT_POLYGONS = 10
+REPORT_CELLS = 3
+
+
+def _polygons(component: gf.Component, layer) -> kdb.Region:
+    region = kdb.Region(component.kdb_cell.begin_shapes_rec(gf.get_layer(layer)))
+    region.merged_semantics = False
+    return region
+
+
+def cell_regions(source: gf.Component) -> dict[str, kdb.Region]:
+    # Shapes of each cell of the source on any layer, in top cell coordinates
+    layout = source.kdb_cell.layout()
+    it = kdb.RecursiveShapeIterator(layout, source.kdb_cell, layout.layer_indexes())
+    polygons = {}
+    while not it.at_end():
+        shape = it.shape().polygon
+        if shape is not None:
+            polygons.setdefault(it.cell().name, []).append(
+                shape.transformed(it.trans())
+            )
+        it.next()
+
+    out = {}
+    for name, items in polygons.items():
+        out[name] = kdb.Region(items)
+        out[name].merged_semantics = False
+    return out
+
+
+def source_cells(cells: dict[str, kdb.Region], polygon: kdb.Polygon):
+    # Cells with shapes touching the polygon, with the number of touching shapes,
+    # most first. cells from cell_regions()
+    target = kdb.Region(polygon)
+    counts = collections.Counter()
+    for name, region in cells.items():
+        if region.bbox().touches(polygon.bbox()):
+            count = region.interacting(target).count()
+            if count:
+                counts[name] = count
+    return counts.most_common()
+
+
+def report(component: gf.Component, source: gf.Component, layers):
+    # Polygons and vertices per layer, and the polygons with the most vertices
+    # with their location (um) and the source cells they come from
+    print(f"{'layer':<24}{'polygons':>11}{'vertices':>12}{'max':>9}")
+    largest = []
+    for layer in layers:
+        polygons = vertices = most = 0
+        for polygon in _polygons(component, layer).each():
+            points = polygon.num_points()
+            polygons += 1
+            vertices += points
+            most = max(most, points)
+            largest.append((points, str(layer), polygon))
+        if polygons:
+            print(f"{str(layer):<24}{polygons:>11}{vertices:>12}{most:>9}")
+
+    largest.sort(key=lambda item: item[0], reverse=True)
+    cells = cell_regions(source)
+    print(f"\n{'vertices':>9}  {'layer':<24}{'x':>10}{'y':>10}  source cells")
+    for points, layer, polygon in largest[:REPORT_POLYGONS]:
+        center = gf.kcl.to_um(polygon.bbox().center())
+        found = source_cells(cells, polygon)
+        names = ", ".join(f"{name} ({count})" for name, count in found[:REPORT_CELLS])
+        if len(found) > REPORT_CELLS:
+            names += f", {len(found) - REPORT_CELLS} more"
+        print(f"{points:>9}  {layer:<24}{center.x:>10.1f}{center.y:>10.1f}  {names}")
+
+
+def split(component: gf.Component, max_vertices: int):
+    # Breaks polygons of the component and the cells below it into parts with at
+    # most max_vertices vertices, in place
+    layout = component.kdb_cell.layout()
+    for cell_index in [component.kdb_cell.cell_index()] + list(
+        component.kdb_cell.called_cells()
+    ):
+        cell = layout.cell(cell_index)
+        for index in layout.layer_indexes():
+            region = kdb.Region(cell.shapes(index))
+            region.merged_semantics = False
+            if all(polygon.num_points() <= max_vertices for polygon in region.each()):
+                continue
+            cell.shapes(index).clear()
+            cell.shapes(index).insert(region.break_(max_vertices, 0))
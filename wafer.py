@@ -0,0 +1,117 @@
+import klayout.db as kdb
+
+import math
+
+# Alignment mark, a cross (um)
+MARK_SIZE = 200
+MARK_WIDTH = 20
+
+# Chips are left out within this distance of an alignment mark (um)
+MARK_KEEPOUT = 500
+
+# Points of the wafer outline
+OUTLINE_POINTS = 360
+
+
+def positions(diameter: float, pitch: float, marks=()) -> list[tuple[float, float]]:
+    # Chip centers (um) on a grid with one chip in the center of the wafer, row by
+    # row from the top. Only whole chips on the wafer, clear of the alignment marks
+    radius = 0.5 * diameter
+    n = math.ceil(radius / pitch)
+    out = []
+    for j in range(n, -n - 1, -1):
+        for i in range(-n, n + 1):
+            x, y = i * pitch, j * pitch
+            if math.hypot(abs(x) + 0.5 * pitch, abs(y) + 0.5 * pitch) > radius:
+                continue
+            if any(
+                abs(mx - x) < 0.5 * pitch + MARK_KEEPOUT
+                and abs(my - y) < 0.5 * pitch + MARK_KEEPOUT
+                for mx, my in marks
+            ):
+                continue
+            out.append((x, y))
+    return out
+
+
+def _rows(placements, pitch: float):
+    # Runs of neighbouring chips in a row, (x, y, count)
+    run = None
+    for x, y in placements:
+        if run and run[1] == y and math.isclose(run[0] + run[2] * pitch, x):
+            run[2] += 1
+            continue
+        if run:
+            yield tuple(run)
+        run = [x, y, 1]
+    if run:
+        yield tuple(run)
+
+
+def mask(
+    chip: kdb.Region,
+    layer,
+    diameter: float,
+    pitch: float,
+    marks=(),
+    outline_layer=None,
+    name: str = "WAFER",
+    mirror: bool = False,
+    dbu: float = 0.001,
+) -> tuple[kdb.Layout, list[tuple[float, float]]]:
+    # Wafer mask of one layer, the chip is stored once and placed as one array per
+    # run of chips in a row, so the array is clipped to the wafer without copying
+    # the chip. Mirrored masks are mirrored as a whole at the y axis
+    layout = kdb.Layout()
+    layout.dbu = dbu
+    index = layout.layer(*layer)
+    top = layout.cell(layout.add_cell(name))
+
+    chip_cell = layout.cell(layout.add_cell(f"{name}_CHIP"))
+    chip_cell.shapes(index).insert(chip)
+
+    placements = positions(diameter, pitch, marks)
+    step = kdb.Vector(round(pitch / dbu), 0)
+    for x, y, count in _rows(placements, pitch):
+        top.insert(
+            kdb.CellInstArray(
+                chip_cell.cell_index(),
+                kdb.Trans(round(x / dbu), round(y / dbu)),
+                step,
+                kdb.Vector(),
+                count,
+                1,
+            )
+        )
+
+    mark_cell = layout.cell(layout.add_cell(f"{name}_MARK"))
+    size, width = round(MARK_SIZE / dbu), round(MARK_WIDTH / dbu)
+    mark_cell.shapes(index).insert(
+        kdb.Region(kdb.Box(-size // 2, -width // 2, size // 2, width // 2))
+        | kdb.Region(kdb.Box(-width // 2, -size // 2, width // 2, size // 2))
+    )
+    for x, y in marks:
+        top.insert(
+            kdb.CellInstArray(
+                mark_cell.cell_index(), kdb.Trans(round(x / dbu), round(y / dbu))
+            )
+        )
+
+    if outline_layer is not None:
+        radius = 0.5 * diameter / dbu
+        top.shapes(layout.layer(*outline_layer)).insert(
+            kdb.Polygon(
+                [
+                    kdb.Point(
+                        round(radius * math.cos(2 * math.pi * i / OUTLINE_POINTS)),
+                        round(radius * math.sin(2 * math.pi * i / OUTLINE_POINTS)),
+                    )
+                    for i in range(OUTLINE_POINTS)
+                ]
+            )
+        )
+
+    if mirror:
+        top.transform(kdb.Trans.M90)
+
+    return layout, placements